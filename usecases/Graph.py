@@ -1,11 +1,34 @@
 import os
+import time
 import pickle
+import shutil
+import tempfile
+from contextlib import contextmanager
 from typing import List
+import numpy as np
 import rdflib
 from rdflib import Namespace, query
 from rdflib.term import IdentifiedNode
+from rdflib.plugins.sparql import prepareQuery
 import utils
 import re
+from itertools import islice
+from triple_store import (
+    BUILD_FILE,
+    SIDE_INDEX_DIR,
+    TERMS_FILE,
+    TripleStore,
+    TripleStoreAdapter,
+    TermBitmap,
+    install_store,
+)
+from label_index import LabelIndex
+import fuzzy_matcher
+from fuzzy_matcher import FuzzyMatcher
+from query_cache import QueryCache
+import sparql_worker
+from sparql_worker import SparqlWorker, SparqlWorkerPool
+from concurrent.futures import ThreadPoolExecutor
 
 
 WD = Namespace("http://www.wikidata.org/entity/")
@@ -14,6 +37,31 @@ SCHEMA = Namespace("http://schema.org/")
 DDIS = Namespace("http://ddis.ch/atai/")
 RDFS = rdflib.namespace.RDFS
 
+# Get the absolute path to the current directory
+current_directory = os.path.dirname(os.path.abspath(__file__))
+
+# compiled triple store directory, the pickled rdflib graph is the fallback
+GRAPH_STORE = os.path.join(current_directory, "data", "graph_store")
+GRAPH_PICKLE = os.path.join(current_directory, "data", "pickle_graph.pickel")
+
+# classes whose members are materialised at load time
+COMMON_CLASSES = {
+    "film": WD.Q2431196,
+    "human": WD.Q5,
+}
+
+# prefixes of HEADER_CONST for prepared queries, plus rdfs
+PREFIXES = {"ddis": DDIS, "wd": WD, "wdt": WDT, "schema": SCHEMA, "rdfs": RDFS}
+
+# rows of a query result shown in one chat message
+CHAT_ROWS = 20
+
+# characters that make a title a regular expression rather than a literal
+REGEX_SYNTAX = re.compile(r"[.^$*+?{}\[\]\\|()]")
+
+# literal values that sparql_query returns as int
+INTEGER = re.compile(r"\s*[+-]?\d+\s*")
+
 HEADER_CONST = """
         PREFIX ddis: <http://ddis.ch/atai/>
         PREFIX wd: <http://www.wikidata.org/entity/>
@@ -22,66 +70,413 @@ HEADER_CONST = """
     """
 
 
+def class_members(store: TripleStore, name: str, cls: rdflib.URIRef) -> TermBitmap:
+    # the closure is cached as a side index of a compiled store
+    ids = [store.term_id(t) for t in (cls, WDT.P31, WDT.P279)]
+    if None in ids:
+        return TermBitmap.from_ids(np.empty(0, dtype=np.int32), store.n_terms)
+    bits = store.side_index(f"class_{name}", lambda: store.instances_of(*ids).bits)
+    return TermBitmap(bits, store.n_terms)
+
+
+def label_table(store: TripleStore) -> np.ndarray:
+    label_id = store.term_id(RDFS.label)
+    if label_id is None:
+        return np.full(store.n_terms, -1, dtype=np.int32)
+    return store.side_index("label_of", lambda: store.first_objects(label_id))
+
+
+def pickle_store_path(filepath: str) -> str:
+    # the store a pickled graph is converted to, the default pickle goes to
+    # the store that default_path prefers
+    if os.path.abspath(filepath) == GRAPH_PICKLE:
+        return GRAPH_STORE
+    return f"{os.path.splitext(filepath)[0]}_store"
+
+
+def open_pickle(filepath: str, output: str) -> TripleStore:
+    # a pickled rdflib graph is converted once and saved as a compiled store,
+    # later starts memory-map it and reuse its side indexes
+    build_file = os.path.join(output, BUILD_FILE)
+    if os.path.exists(build_file) and (
+        os.path.getmtime(build_file) >= os.path.getmtime(filepath)
+    ):
+        return TripleStore.open(output)
+
+    with open(filepath, "rb") as graph:
+        store = TripleStore.from_graph(pickle.load(graph))
+    output = os.path.abspath(output)
+    try:
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+        build_dir = tempfile.mkdtemp(
+            dir=os.path.dirname(output), prefix=f".{os.path.basename(output)}."
+        )
+    except OSError:
+        # e.g. a read-only data folder, the store then lives in memory only
+        return store
+    try:
+        os.chmod(build_dir, 0o755)
+        store.save(build_dir)
+        os.makedirs(os.path.join(build_dir, SIDE_INDEX_DIR), exist_ok=True)
+        install_store(build_dir, output)
+    except OSError:
+        return store
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return TripleStore.open(output)
+
+
+class SparqlRows(list):
+    """Converted result rows, truncated when the row cap cut off the rest."""
+
+    def __init__(self, rows=(), truncated: bool = False):
+        super().__init__(rows)
+        self.truncated = truncated
+
+
 class Graph:
     def __init__(self, filepath: str):
-        with open(filepath, "rb") as graph:
-            self.g: rdflib.Graph = pickle.load(graph)
+        # results of sparql_query, keyed on the cleaned query text
+        self.query_cache = QueryCache()
+        # child process evaluating user supplied queries, started on first use
+        self.sparql_worker: SparqlWorker | SparqlWorkerPool | None = None
+
+        # the fixed query shapes of the bot, parsed and translated only once
+        self.prepared_queries = {
+            "film_by_name": prepareQuery(
+                utils.GET_FILM_BY_NAME_FILTER, initNs=PREFIXES
+            ),
+        }
+        # seconds spent in each load and warm-up phase
+        self.timings: dict[str, float] = {}
+        self.load(filepath)
+
+    @contextmanager
+    def phase(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = time.perf_counter() - start
+
+    def report_timings(self):
+        for name, seconds in self.timings.items():
+            print(f"Graph {name}: {seconds:.3f}s")
+
+    def load(self, filepath: str):
+        self.filepath = filepath
+        self.timings.clear()
+        with self.phase("load.store"):
+            if os.path.isdir(filepath):
+                # compiled triple store, memory-mapped
+                self.store = TripleStore.open(filepath)
+            else:
+                # legacy pickled rdflib graph, converted to a triple store once
+                self.store = open_pickle(filepath, pickle_store_path(filepath))
+            self.g: rdflib.Graph = rdflib.Graph(store=TripleStoreAdapter(self.store))
+
+        # transitive wdt:P31/wdt:P279* closure of the common classes
+        with self.phase("load.class_members"):
+            self.class_members: dict[str, TermBitmap] = {
+                name: self.build_class_members(name, cls)
+                for name, cls in COMMON_CLASSES.items()
+            }
+
+        # label term id of every entity, -1 for entities without a label
+        with self.phase("load.label_table"):
+            self.label_of = self.build_label_table()
+
+        # labels of all films, so title lookups do not need a REGEX query
+        with self.phase("load.film_labels"):
+            self.film_labels = self.build_film_label_index()
+
+        # approximate search over every label, e.g. titles without punctuation
+        with self.phase("load.label_matcher"):
+            self.label_matcher = self.build_label_matcher()
+            self.film_label_mask = self.class_members["film"].mask(
+                self.label_matcher.entities
+            )
+
+        # cached results belong to the graph that was loaded before
+        self.query_cache.clear()
+        if getattr(self, "sparql_worker", None) is not None:
+            # the forked worker still holds the previous graph
+            self.sparql_worker.stop()
+
+    def reload(self):
+        self.load(self.filepath)
+
+    def warm_up(self, samples: int = 100):
+        # runs every lookup path of the bot once, so the first question of a
+        # chatroom does not pay for cold pages, caches and lazy imports
+        films = self.class_members["film"].ids()[:samples]
+        film_terms = [self.store.term(int(f)) for f in films]
+
+        with self.phase("warm_up.film_closure"):
+            for film in film_terms:
+                self.is_instance_of(film, "film")
+                self.is_instance_of(film, "human")
+
+        with self.phase("warm_up.labels"):
+            labels = self.entities_to_labels(film_terms)
+            for label in labels[:10]:
+                if label is not None:
+                    self.get_movie_with_label(str(label))
+                    self.fuzzy_find_label(str(label)[:-1], "film")
+
+        with self.phase("warm_up.queries"):
+            for film in film_terms[:10]:
+                self.get_answer(str(WDT.P57), str(film))
+            if film_terms:
+                # parser, algebra and evaluation of a user query, uncached
+                query = f"SELECT ?lbl WHERE {{ <{film_terms[0]}> rdfs:label ?lbl . }}"
+                list(self.iter_sparql(HEADER_CONST + query, 1))
+
+        self.report_timings()
+
+    @staticmethod
+    def default_path() -> str:
+        # an empty or half written store directory falls back to the pickle
+        if os.path.exists(os.path.join(GRAPH_STORE, TERMS_FILE)):
+            return GRAPH_STORE
+        return GRAPH_PICKLE
+
+    def build_class_members(self, name: str, cls: rdflib.URIRef) -> TermBitmap:
+        return class_members(self.store, name, cls)
+
+    def is_instance_of(self, entity: IdentifiedNode, class_name: str = "film") -> bool:
+        term_id = self.store.term_id(entity)
+        return term_id is not None and term_id in self.class_members[class_name]
+
+    def build_film_label_index(self) -> LabelIndex:
+        label_id = self.store.term_id(RDFS.label)
+        if label_id is None:
+            return LabelIndex([])
+
+        films, _, labels = self.store.match(p=label_id)
+        is_film = self.class_members["film"].mask(films)
+        decode = self.store.decode_term
+        return LabelIndex(
+            (str(decode(l)), f, l)
+            for f, l in zip(films[is_film].tolist(), labels[is_film].tolist())
+        )
+
+    def build_label_matcher(self) -> FuzzyMatcher:
+        label_id = self.store.term_id(RDFS.label)
+        if label_id is None:
+            return FuzzyMatcher.build([])
+
+        # the trigram index is built once per store and cached as side indexes
+        built = {}
+
+        def build_array(name: str) -> np.ndarray:
+            if not built:
+                entities, _, labels = self.store.match(p=label_id)
+                decode = self.store.decode_term
+                matcher = FuzzyMatcher.build(
+                    (str(decode(l)), e, l)
+                    for e, l in zip(entities.tolist(), labels.tolist())
+                )
+                built.update(matcher.to_arrays())
+            return built[name]
+
+        return FuzzyMatcher.from_arrays(
+            {
+                name: self.store.side_index(
+                    f"label_matcher_{name}", lambda name=name: build_array(name)
+                )
+                for name in FuzzyMatcher.ARRAYS
+            }
+        )
+
+    def fuzzy_find_label(
+        self,
+        text: str,
+        class_name: str | None = None,
+        limit: int = 1,
+        cutoff: float = fuzzy_matcher.DEFAULT_CUTOFF,
+    ) -> List[tuple[IdentifiedNode, rdflib.Literal, float]]:
+        # (entity, label, similarity) of the closest labels, best first
+        allowed = None
+        if class_name == "film":
+            allowed = self.film_label_mask
+        elif class_name is not None:
+            allowed = self.class_members[class_name].mask(self.label_matcher.entities)
+
+        matches = self.label_matcher.search(text, limit, cutoff, allowed)
+        term = self.store.term
+        return [
+            (
+                term(int(self.label_matcher.entities[pos])),
+                term(int(self.label_matcher.labels[pos])),
+                score,
+            )
+            for pos, score in matches
+        ]
+
+    def build_label_table(self) -> np.ndarray:
+        return label_table(self.store)
 
     def entity_to_label(self, entity: IdentifiedNode) -> IdentifiedNode | None:
-        for x in self.g.objects(entity, RDFS.label, True):
-            return x
-        return None
+        return self.entities_to_labels([entity])[0]
+
+    def entities_to_labels(
+        self, entities: List[IdentifiedNode]
+    ) -> List[IdentifiedNode | None]:
+        labels = []
+        for entity in entities:
+            term_id = self.store.term_id(entity) if entity is not None else None
+            label = -1 if term_id is None else self.label_of[term_id]
+            labels.append(self.store.term(int(label)) if label >= 0 else None)
+        return labels
 
     def get_movie_with_label(self, film_name: str) -> List[IdentifiedNode]:
-        query = utils.GET_FILM_BY_NAME_FILTER % {
-            "filmName": utils.lower_remove_sent_endings_at_end(film_name)
-        }
-        res = list(self.g.query(HEADER_CONST + query))
+        film_name = utils.lower_remove_sent_endings_at_end(film_name)
+        hit = self.film_labels.find(film_name)
+        if hit is not None:
+            film, label = hit
+            return self.store.term(film), self.store.term(label)
+
+        # titles that are written slightly differently than the label
+        matches = self.fuzzy_find_label(film_name, "film")
+        if matches:
+            film, label, _ = matches[0]
+            return film, label
+
+        # the index matches literally, only a name with regular expression
+        # syntax can still match in the REGEX filter
+        if REGEX_SYNTAX.search(film_name) is None:
+            return []
+
+        try:
+            res = self.run_prepared("film_by_name", filmName=rdflib.Literal(film_name))
+        except re.error:
+            return []
         return res[0] if len(res) > 0 else []
 
-    def get_answer(self, predicate: str, entity: str) -> str:
+    def run_prepared(self, name: str, **bindings) -> list:
+        return list(self.g.query(self.prepared_queries[name], initBindings=bindings))
+
+    def get_answer(self, predicate: str, entity: str, limit: int = 1) -> List[str]:
         entity = re.search(r"[QP]\d+", entity)
         predicate = re.search(r"[QP]\d+", predicate)
-        query = f"""
-        SELECT ?result WHERE {{
-        wd:{entity.group()} wdt:{predicate.group()} ?result .
-        }}
-        LIMIT 1
-        """
-        return self.sparql_query(HEADER_CONST + query)
+
+        # direct lookup in the SPO index instead of a one-triple SPARQL query
+        subject_id = self.store.term_id(WD[entity.group()])
+        predicate_id = self.store.term_id(WDT[predicate.group()])
+        if subject_id is None or predicate_id is None:
+            return []
+
+        objects = self.store.match(subject_id, predicate_id)[2][:limit]
+        return [self.handle_none(self.store.term(o)) for o in objects.tolist()]
 
     def handle_none(self, query):
         return "None" if query is None else str(query)
 
-    def sparql_query(self, query):
-        # clean input
+    @staticmethod
+    def clean_query(query: str) -> str:
         query = query.replace("'''", "\n")
         query = query.replace("‘’’", "\n")
         query = query.replace("PREFIX", "\nPREFIX")
+        return query
+
+    def query_cache_key(self, query: str, max_rows: int | None) -> str:
+        return f"{max_rows}\n{self.query_cache.normalise(query)}"
+
+    def sparql_query(self, query, max_rows: int | None = None):
+        # clean input
+        query = self.clean_query(query)
+
+        cache_key = self.query_cache_key(query, max_rows)
+        found, cached = self.query_cache.get(cache_key)
+        if found:
+            return SparqlRows(cached, cached.truncated)
 
         try:
-            result = self.g.query(query)
-            # Handle different conditions
-            processed_result = []
-            for item in result:
-                try:
-                    # Unpack as (str, int)
-                    s, nc = item
-                    processed_result.append(
-                        (str(self.handle_none(s)), int(self.handle_none(nc)))
-                    )
-                except ValueError:
-                    try:
-                        # Unpack as (str, str)
-                        s, nc = item
-                        processed_result.append(
-                            (str(self.handle_none(s)), str(self.handle_none(nc)))
-                        )
-                    except ValueError:
-                        # String value
-                        processed_result.append(str(self.handle_none(item[0])))
-            result = processed_result
+            result = self.evaluate_sparql(query, max_rows)
+            self.query_cache.put(cache_key, SparqlRows(result, result.truncated))
         except Exception as e:
             result = f"Error: {str(e)}"
 
         return result
+
+    def evaluate_sparql(self, query, max_rows: int | None = None) -> SparqlRows:
+        # one row past the cap tells whether the result was cut off
+        if max_rows is None:
+            return SparqlRows(self.iter_sparql(query))
+        rows = list(self.iter_sparql(query, max_rows + 1))
+        return SparqlRows(rows[:max_rows], len(rows) > max_rows)
+
+    def iter_sparql(self, query, max_rows: int | None = None):
+        # rows are converted while rdflib evaluates lazily, nothing past
+        # max_rows is evaluated
+        for row in islice(self.g.query(query), max_rows):
+            yield self.convert_row(row)
+
+    def convert_row(self, row):
+        # pairs become (str, int) when the second value is an integer,
+        # (str, str) otherwise, any other shape its first value as str
+        if not isinstance(row, tuple):
+            return str(row)
+        if len(row) == 2:
+            s, nc = self.handle_none(row[0]), self.handle_none(row[1])
+            return (s, int(nc)) if INTEGER.fullmatch(nc) else (s, nc)
+        return self.handle_none(row[0])
+
+    @staticmethod
+    def format_rows(result, limit: int = CHAT_ROWS) -> str:
+        # chat messages show the first rows only, a result cut off at the row
+        # cap has an unknown number of rows more
+        if isinstance(result, str):
+            return result
+        truncated = getattr(result, "truncated", False)
+        if len(result) <= limit:
+            return f"{list(result)} (truncated)" if truncated else str(list(result))
+        more = len(result) - limit
+        if truncated:
+            return f"{result[:limit]} ... and {more}+ more rows (truncated)"
+        return f"{result[:limit]} ... and {more} more rows"
+
+    def guarded_sparql_query(
+        self, query, timeout: float | None = None, max_rows: int | None = None
+    ):
+        # user supplied queries run in a worker that is killed on timeout
+        if not SparqlWorker.is_supported():
+            return self.sparql_query(query, max_rows or sparql_worker.DEFAULT_MAX_ROWS)
+        if self.sparql_worker is None:
+            self.sparql_worker = SparqlWorker(self)
+
+        max_rows = max_rows or self.sparql_worker.max_rows
+        cache_key = self.query_cache_key(self.clean_query(query), max_rows)
+        found, cached = self.query_cache.get(cache_key)
+        if found:
+            return SparqlRows(cached, cached.truncated)
+
+        result = self.sparql_worker.query(query, timeout, max_rows)
+        if not isinstance(result, str):
+            # workers leave the cache to the parent
+            self.query_cache.put(cache_key, SparqlRows(result, result.truncated))
+        return result
+
+    def serve(self, workers: int | None = None):
+        # user queries are spread over a pool of worker processes from now on
+        if self.sparql_worker is not None:
+            self.sparql_worker.stop()
+        self.sparql_worker = SparqlWorkerPool(self, workers)
+        self.sparql_worker.start()
+
+    def query_many(
+        self,
+        queries: List[str],
+        timeout: float | None = None,
+        max_rows: int | None = None,
+    ) -> list:
+        # results in the order of the queries, in parallel when serving a pool
+        if not isinstance(self.sparql_worker, SparqlWorkerPool):
+            return [self.guarded_sparql_query(q, timeout, max_rows) for q in queries]
+        with ThreadPoolExecutor(max_workers=len(self.sparql_worker)) as executor:
+            return list(
+                executor.map(
+                    lambda q: self.guarded_sparql_query(q, timeout, max_rows), queries
+                )
+            )
@@ -0,0 +1,286 @@
+import os
+import argparse
+import numpy as np
+from embedding_store import EmbeddingStore, l2_distances, squared_norms
+
+# Get the absolute path to the current directory
+current_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Define the relative path to the "data" folder
+data_folder = os.path.join(current_directory, "data")
+
+ENTITY_EMBEDS = os.path.join(data_folder, "entity_embeds.npy")
+ENTITY_INDEX = os.path.join(data_folder, "entity_embeds.ivf.npz")
+
+# number of inverted lists scanned per query, higher = better recall, slower
+DEFAULT_NPROBE = 8
+
+
+# upper bound for the distance matrix computed in one go by batched searches
+DEFAULT_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def top_k_smallest(dist: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+    # partial selection of the k smallest values (per row for a 2d array),
+    # only the winners get sorted
+    n = dist.shape[-1]
+    k = min(k, n)
+    if k <= 0:
+        empty = dist.shape[:-1] + (0,)
+        return np.empty(empty, dtype=np.int64), np.empty(empty, dtype=dist.dtype)
+    if k < n:
+        idx = np.argpartition(dist, k - 1, axis=-1)[..., :k]
+    else:
+        idx = np.broadcast_to(np.arange(n), dist.shape).copy()
+    order = np.argsort(np.take_along_axis(dist, idx, axis=-1), axis=-1, kind="stable")
+    idx = np.take_along_axis(idx, order, axis=-1)
+    return idx, np.take_along_axis(dist, idx, axis=-1)
+
+
+def query_chunks(queries: np.ndarray, n_vectors: int, chunk_bytes: int):
+    # split the queries so one chunk x n_vectors float32 matrix fits chunk_bytes
+    rows = max(1, chunk_bytes // (4 * max(1, n_vectors)))
+    for start in range(0, len(queries), rows):
+        yield queries[start : start + rows]
+
+
+class ExactIndex(object):
+    """Brute-force scan over every vector, used when no ANN index was built."""
+
+    def __init__(
+        self,
+        store: EmbeddingStore,
+        metric: str = "l2",
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    ):
+        self.store = store
+        self.metric = metric
+        self.chunk_bytes = chunk_bytes
+
+    def search(
+        self, query: np.ndarray, k: int = 1, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        ids, dist = self.search_many(query.reshape(1, -1), k, rows)
+        return ids[0], dist[0]
+
+    def search_many(
+        self, queries: np.ndarray, k: int = 1, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # rows restricts the scan to a subset of the entities
+        ids, dists = [], []
+        n_vectors = len(self.store.entity_emb) if rows is None else len(rows)
+        for chunk in query_chunks(queries, n_vectors, self.chunk_bytes):
+            # one distance matrix for the whole chunk of queries
+            dist = self.store.distances(chunk, rows, self.metric)
+            chunk_ids, chunk_dist = top_k_smallest(dist, k)
+            if rows is not None:
+                chunk_ids = rows[chunk_ids]
+            ids.append(chunk_ids)
+            dists.append(chunk_dist)
+        return np.concatenate(ids), np.concatenate(dists)
+
+
+class IVFIndex(object):
+    """
+    Inverted file index: the vectors are clustered with k-means and every
+    vector is stored in the list of its closest centroid. A query only scans
+    the `nprobe` lists whose centroids are closest to it.
+    """
+
+    def __init__(
+        self,
+        store: EmbeddingStore,
+        centroids: np.ndarray,
+        list_offsets: np.ndarray,
+        list_ids: np.ndarray,
+        nprobe: int = DEFAULT_NPROBE,
+        metric: str = "l2",
+        chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+    ):
+        self.store = store
+        self.metric = metric
+        self.centroids = centroids
+        self.centroid_sq_norms = squared_norms(centroids)
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        # list of every vector, to restrict a query to its own probed lists
+        self.list_of = np.empty(len(list_ids), dtype=np.int32)
+        self.list_of[list_ids] = np.repeat(
+            np.arange(len(centroids), dtype=np.int32), np.diff(list_offsets)
+        )
+        self.nprobe = nprobe
+        self.chunk_bytes = chunk_bytes
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    @classmethod
+    def build(
+        cls,
+        store: EmbeddingStore,
+        n_lists: int | None = None,
+        n_iter: int = 20,
+        sample_size: int = 100_000,
+        seed: int = 0,
+    ):
+        vectors = store.entity_emb
+        rng = np.random.default_rng(seed)
+        if n_lists is None:
+            n_lists = max(1, int(4 * np.sqrt(len(vectors))))
+        n_lists = min(n_lists, len(vectors))
+
+        # train the coarse quantiser on a sample of the vectors
+        sample = vectors
+        if len(vectors) > sample_size:
+            sample = vectors[rng.choice(len(vectors), sample_size, replace=False)]
+        sample = np.asarray(sample, dtype=np.float32)
+
+        centroids = sample[rng.choice(len(sample), n_lists, replace=False)].copy()
+        for _ in range(n_iter):
+            assignment = l2_distances(sample, centroids).argmin(axis=1)
+            for c in range(n_lists):
+                members = sample[assignment == c]
+                if len(members):
+                    centroids[c] = members.mean(axis=0)
+
+        # assign every vector to its list and store the lists contiguously
+        assignment = np.concatenate(
+            [
+                l2_distances(chunk, centroids).argmin(axis=1)
+                for chunk in query_chunks(vectors, n_lists, DEFAULT_CHUNK_BYTES)
+            ]
+        )
+        list_ids = np.argsort(assignment, kind="stable").astype(np.int64)
+        counts = np.bincount(assignment, minlength=n_lists)
+        list_offsets = np.concatenate(([0], np.cumsum(counts))).astype(np.int64)
+
+        return cls(store, centroids, list_offsets, list_ids)
+
+    def save(self, path: str):
+        np.savez(
+            path,
+            centroids=self.centroids,
+            list_offsets=self.list_offsets,
+            list_ids=self.list_ids,
+        )
+
+    @classmethod
+    def load(
+        cls,
+        path: str,
+        store: EmbeddingStore,
+        nprobe: int = DEFAULT_NPROBE,
+        metric: str = "l2",
+    ):
+        # None when the index was built for a different number of entities
+        with np.load(path) as data:
+            if len(data["list_ids"]) != len(store.entity_emb):
+                return None
+            return cls(
+                store,
+                data["centroids"],
+                data["list_offsets"],
+                data["list_ids"],
+                nprobe,
+                metric,
+            )
+
+    def search(
+        self, query: np.ndarray, k: int = 1, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        ids, dist = self.search_many(query.reshape(1, -1), k, rows)
+        return ids[0], dist[0]
+
+    def search_many(
+        self, queries: np.ndarray, k: int = 1, rows: np.ndarray | None = None
+    ) -> tuple[np.ndarray, np.ndarray]:
+        # a given subset of rows is small enough to be scanned exactly
+        if rows is not None:
+            exact = ExactIndex(self.store, self.metric, self.chunk_bytes)
+            return exact.search_many(queries, k, rows)
+
+        nprobe = min(self.nprobe, self.n_lists)
+
+        ids, dists = [], []
+        n_vectors = len(self.store.entity_emb)
+        for chunk in query_chunks(queries, n_vectors, self.chunk_bytes):
+            centroid_dist = l2_distances(chunk, self.centroids, self.centroid_sq_norms)
+            probe, _ = top_k_smallest(centroid_dist, nprobe)
+
+            # scan the union of the probed lists of the chunk in one go, then
+            # hide from every query the lists it did not probe itself, so a
+            # batched answer equals the answer to the query alone
+            candidates = np.unique(
+                np.concatenate(
+                    [
+                        self.list_ids[self.list_offsets[c] : self.list_offsets[c + 1]]
+                        for c in np.unique(probe)
+                    ]
+                )
+            )
+            if len(candidates) < k:
+                exact = ExactIndex(self.store, self.metric, self.chunk_bytes)
+                chunk_ids, chunk_dist = exact.search_many(chunk, k)
+                ids.append(chunk_ids)
+                dists.append(chunk_dist)
+                continue
+
+            probed = np.zeros((len(chunk), self.n_lists), dtype=bool)
+            probed[np.arange(len(chunk))[:, None], probe] = True
+            own = probed[:, self.list_of[candidates]]
+
+            dist = self.store.distances(chunk, candidates, self.metric)
+            dist[~own] = np.inf
+            idx, chunk_dist = top_k_smallest(dist, k)
+            chunk_ids = candidates[idx]
+
+            # the probed lists of a query are too small to fill k results,
+            # it scans everything
+            short = np.flatnonzero(own.sum(axis=1) < k)
+            if len(short):
+                exact = ExactIndex(self.store, self.metric, self.chunk_bytes)
+                chunk_ids[short], chunk_dist[short] = exact.search_many(chunk[short], k)
+
+            ids.append(chunk_ids)
+            dists.append(chunk_dist)
+        return np.concatenate(ids), np.concatenate(dists)
+
+
+def load_index(
+    store: EmbeddingStore,
+    path: str = ENTITY_INDEX,
+    nprobe: int | None = DEFAULT_NPROBE,
+    metric: str = "l2",
+    embeds_path: str = ENTITY_EMBEDS,
+) -> ExactIndex | IVFIndex:
+    # nprobe=None forces the exact scan, e.g. to measure the recall of the index
+    if nprobe is None or not os.path.exists(path):
+        return ExactIndex(store, metric)
+    # an index older than the embeddings lists the rows of the old vectors
+    if os.path.exists(embeds_path) and os.path.getmtime(path) < os.path.getmtime(
+        embeds_path
+    ):
+        return ExactIndex(store, metric)
+    index = IVFIndex.load(path, store, nprobe, metric)
+    if index is None:
+        return ExactIndex(store, metric)
+    return index
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Build the IVF index for the entity embeddings."
+    )
+    parser.add_argument("--embeddings", default=ENTITY_EMBEDS)
+    parser.add_argument("--output", default=ENTITY_INDEX)
+    parser.add_argument("--lists", type=int, default=None)
+    parser.add_argument("--iterations", type=int, default=20)
+    args = parser.parse_args()
+
+    store = EmbeddingStore(entity_emb_path=args.embeddings)
+    index = IVFIndex.build(store, n_lists=args.lists, n_iter=args.iterations)
+    index.save(args.output)
+    print(
+        f"Saved {index.n_lists} lists for {len(store.entity_emb)} entities to {args.output}"
+    )
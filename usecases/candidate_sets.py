@@ -0,0 +1,116 @@
+import os
+import csv
+from typing import Callable
+import numpy as np
+import rdflib
+
+# Get the absolute path to the current directory
+current_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Define the relative path to the "data" folder
+data_folder = os.path.join(current_directory, "data")
+
+RELATION_IDS = os.path.join(data_folder, "relation_ids.del")
+RELATION_CANDIDATES = os.path.join(data_folder, "relation_candidates.npz")
+ENTITY_IDS = os.path.join(data_folder, "entity_ids.del")
+
+
+class RelationCandidates(object):
+    """
+    Per relation the sorted entity rows that occur as object of the relation
+    in the graph. Link prediction answers only need to be scored against these.
+    """
+
+    def __init__(self, candidates: dict[int, np.ndarray]):
+        self.candidates = candidates
+
+    def get(self, relation_key: int) -> np.ndarray | None:
+        return self.candidates.get(relation_key)
+
+    @classmethod
+    def build(
+        cls,
+        store,
+        ent_lookup: Callable[[str], int | None],
+        relation_ids_path: str = RELATION_IDS,
+    ):
+        with open(relation_ids_path, "r") as ifile:
+            relations = {
+                int(idx): rdflib.term.URIRef(rel)
+                for idx, rel in csv.reader(ifile, delimiter="\t")
+            }
+
+        # object term ids of every relation, read from the POS index
+        objects = {}
+        for relation_key, predicate in relations.items():
+            predicate_id = store.term_id(predicate)
+            if predicate_id is not None:
+                objects[relation_key] = np.unique(store.match(p=predicate_id)[2])
+
+        # each object term is decoded once, -1 for terms without a row
+        term_ids = np.unique(
+            np.concatenate([np.empty(0, dtype=np.int32)] + list(objects.values()))
+        )
+        term_rows = np.full(len(term_ids), -1, dtype=np.int32)
+        for i, term_id in enumerate(term_ids.tolist()):
+            key = store.terms[term_id]
+            if key.startswith(b"<") and key.endswith(b">"):
+                row = ent_lookup(key[1:-1].decode("utf-8"))
+                if row is not None:
+                    term_rows[i] = row
+
+        candidates = {}
+        for relation_key, ids in objects.items():
+            rows = term_rows[np.searchsorted(term_ids, ids)]
+            rows = np.unique(rows[rows >= 0])
+            if len(rows):
+                candidates[relation_key] = rows
+        return cls(candidates)
+
+    def save(self, path: str = RELATION_CANDIDATES, stamp: dict | None = None):
+        # the stamp says which graph build and entity table the rows are for
+        arrays = {str(k): v for k, v in self.candidates.items()}
+        for name, value in (stamp or {}).items():
+            arrays[f"_{name}"] = np.array(value)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(f, **arrays)
+            os.replace(tmp_path, path)
+        except OSError:
+            pass
+
+    @classmethod
+    def load(cls, path: str = RELATION_CANDIDATES, stamp: dict | None = None):
+        # None when the file is missing or was built for another stamp
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            for name, value in (stamp or {}).items():
+                if f"_{name}" not in data.files or data[f"_{name}"].item() != value:
+                    return None
+            return cls({int(k): data[k] for k in data.files if not k.startswith("_")})
+
+    @classmethod
+    def open(
+        cls,
+        store,
+        ent_lookup: Callable[[str], int | None],
+        relation_ids_path: str = RELATION_IDS,
+        ent_ids_path: str = ENTITY_IDS,
+        path: str = RELATION_CANDIDATES,
+    ):
+        # cached for one build of the store and one version of the id files, a
+        # store that was never saved has no build and is not cached
+        if store.build is None:
+            return cls.build(store, ent_lookup, relation_ids_path)
+        stamp = {
+            "build": store.build,
+            "entity_ids_mtime": os.path.getmtime(ent_ids_path),
+            "relation_ids_mtime": os.path.getmtime(relation_ids_path),
+        }
+        candidates = cls.load(path, stamp)
+        if candidates is None:
+            candidates = cls.build(store, ent_lookup, relation_ids_path)
+            candidates.save(path, stamp)
+        return candidates
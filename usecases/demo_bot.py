@@ -28,42 +28,10 @@ class Agent:
         )
         self.speakeasy.login()  # This framework will help you log out automatically when the program terminates.
         self.ec = EntryClassifier()
-
-    def handle_none(self, query):
-        return "None" if query is None else str(query)
-
-    def sparql_query(self, query):
-        # clean input
-        query = query.replace("'''", "\n")
-        query = query.replace("‘’’", "\n")
-        query = query.replace("PREFIX", "\nPREFIX")
-
-        try:
-            result = self.graph.query(query)
-            # Handle different conditions
-            processed_result = []
-            for item in result:
-                try:
-                    # Unpack as (str, int)
-                    s, nc = item
-                    processed_result.append(
-                        (str(self.handle_none(s)), int(self.handle_none(nc)))
-                    )
-                except ValueError:
-                    try:
-                        # Unpack as (str, str)
-                        s, nc = item
-                        processed_result.append(
-                            (str(self.handle_none(s)), str(self.handle_none(nc)))
-                        )
-                    except ValueError:
-                        # String value
-                        processed_result.append(str(self.handle_none(item[0])))
-            result = processed_result
-        except Exception as e:
-            result = f"Error: {str(e)}"
-
-        return result
+        # warm before forking, so the query workers start warm too
+        self.ec.graph.warm_up()
+        # user SPARQL queries are evaluated by a pool of worker processes
+        self.ec.graph.serve()
 
     @staticmethod
     def is_sparql(query):
@@ -84,6 +52,9 @@ class Agent:
         ]
 
         while True:
+            # messages of all rooms in this poll cycle, answered together below
+            pending = []
+
             # only check active chatrooms (i.e., remaining_time > 0) if active=True.
             rooms: List[Chatroom] = self.speakeasy.get_rooms(active=True)
             for room in rooms:
@@ -104,31 +75,12 @@ class Agent:
                         f"- {self.get_time()}"
                     )
 
-                    # Implement your agent here #
-                    #
-                    # Extract query from message
-                    query = message.message
-
                      # Select a random response template
                     response_message = random.choice(response_templates)
 
                     # Send a randomized response message
                     room.post_messages(response_message)
-                    # Mark the message as processed, so it will be filtered out when retrieving new messages.
-
-                    if self.is_sparql(query):
-                        respond = self.sparql_query(message.message)
-                        room.post_messages(f"Query answer: '{respond}' ")
-                    else:
-                        try:
-                            respond = self.ec.start(query)
-                            print(f"Respond: {respond}")
-                            room.post_messages(respond)
-                        except Exception as e:
-                            print(f"Error: {str(e)}")
-                            room.post_messages("Sorry, I ran into an issue here. Should we try another question instead?")
-
-                    room.mark_as_processed(message)
+                    pending.append((room, message))
                 # Retrieve reactions from this chat room.
                 # If only_new=True, it filters out reactions that have already been marked as processed.
                 for reaction in room.get_reactions(only_new=True):
@@ -143,8 +95,43 @@ class Agent:
                     room.post_messages(f"Oh wow.. Thanks for the reaction '{reaction.type}' ")
                     room.mark_as_processed(reaction)
 
+            self.answer_messages(pending)
+
             time.sleep(listen_freq)
 
+    def answer_messages(self, pending: List[tuple]):
+        # SPARQL queries go to the graph's worker pool and natural language
+        # questions to the classifier, each kind of all rooms as one batch
+        queries, questions = [], []
+        for room, message in pending:
+            if self.is_sparql(message.message):
+                queries.append((room, message))
+            else:
+                questions.append((room, message))
+
+        if queries:
+            responses = self.ec.graph.query_many(
+                [message.message for _, message in queries]
+            )
+            for (room, message), respond in zip(queries, responses):
+                room.post_messages(f"Query answer: '{self.ec.graph.format_rows(respond)}' ")
+                # Mark the message as processed, so it will be filtered out when retrieving new messages.
+                room.mark_as_processed(message)
+
+        if not questions:
+            return
+
+        responses = self.ec.start_many([message.message for _, message in questions])
+        for (room, message), respond in zip(questions, responses):
+            if isinstance(respond, Exception):
+                print(f"Error: {str(respond)}")
+                room.post_messages("Sorry, I ran into an issue here. Should we try another question instead?")
+            else:
+                print(f"Respond: {respond}")
+                room.post_messages(respond)
+
+            room.mark_as_processed(message)
+
     @staticmethod
     def get_time():
         return time.strftime("%H:%M:%S, %d-%m-%Y", time.localtime())
@@ -0,0 +1,104 @@
+import os
+import atexit
+import threading
+from collections import OrderedDict
+from typing import Callable, List
+import numpy as np
+
+# number of distinct texts kept
+DEFAULT_MAX_SIZE = 50_000
+
+
+class EmbeddingCache(object):
+    """
+    Bounded LRU cache of text -> sentence embedding. Only texts that miss
+    are encoded, in one batch. With a path, the entries are loaded at start
+    up and written back at exit, tagged with the model that produced them.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_size: int = DEFAULT_MAX_SIZE,
+        path: str | None = None,
+    ):
+        self.model_name = model_name
+        self.max_size = max_size
+        self.path = path
+        self.entries: OrderedDict[str, np.ndarray] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+        if path is not None:
+            self.load()
+            atexit.register(self.save)
+
+    def __len__(self) -> int:
+        return len(self.entries)
+
+    def encode(
+        self, texts: List[str], encode: Callable[[List[str]], np.ndarray]
+    ) -> np.ndarray:
+        # embeddings of texts in order, encode is called with the misses only
+        with self.lock:
+            found = {}
+            for text in texts:
+                embedding = self.entries.get(text)
+                if embedding is not None:
+                    self.entries.move_to_end(text)
+                    found[text] = embedding
+            self.hits += sum(text in found for text in texts)
+
+        misses = list(dict.fromkeys(text for text in texts if text not in found))
+        if misses:
+            encoded = np.asarray(encode(misses), dtype=np.float32)
+            found.update(zip(misses, encoded))
+            self.put_many(misses, encoded)
+
+        return np.stack([found[text] for text in texts])
+
+    def put_many(self, texts: List[str], embeddings: np.ndarray):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.misses += len(texts)
+            for text, embedding in zip(texts, embeddings):
+                self.entries[text] = embedding
+                self.entries.move_to_end(text)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        with np.load(self.path, allow_pickle=False) as data:
+            if str(data["model"]) != self.model_name:
+                return
+            texts, embeddings = data["texts"].tolist(), data["embeddings"]
+        self.put_many(texts[-self.max_size :], embeddings[-self.max_size :])
+        self.misses = 0
+
+    def save(self):
+        with self.lock:
+            texts = list(self.entries)
+            embeddings = np.stack(list(self.entries.values())) if texts else None
+        if embeddings is None:
+            return
+        # least recently used first, so a smaller cache keeps the recent ones
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_path, "wb") as f:
+                np.savez(
+                    f,
+                    model=np.array(self.model_name),
+                    texts=np.array(texts),
+                    embeddings=embeddings,
+                )
+            os.replace(tmp_path, self.path)
+        except OSError:
+            pass
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,143 @@
+import os
+import threading
+import numpy as np
+
+# Get the absolute path to the current directory
+current_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Define the relative path to the "data" folder
+data_folder = os.path.join(current_directory, "data")
+
+ENTITY_EMBEDS = os.path.join(data_folder, "entity_embeds.npy")
+RELATION_EMBEDS = os.path.join(data_folder, "relation_embeds.npy")
+
+# "l2" matches the euclidean scoring used so far, "l1" is the norm TransE
+# was trained with
+METRICS = ("l2", "l1")
+
+# rows of the entity matrix up-cast and scored at once
+BLOCK_ROWS = 65536
+# upper bound for the temporary |q - e| tensor of the l1 kernel
+L1_CHUNK_BYTES = 64 * 1024 * 1024
+
+
+def squared_norms(x: np.ndarray, block_rows: int = BLOCK_ROWS) -> np.ndarray:
+    norms = np.empty(len(x), dtype=np.float32)
+    for start in range(0, len(x), block_rows):
+        block = np.asarray(x[start : start + block_rows], dtype=np.float32)
+        norms[start : start + block_rows] = np.einsum("ij,ij->i", block, block)
+    return norms
+
+
+def l2_distances(
+    queries: np.ndarray,
+    x: np.ndarray,
+    x_sq_norms: np.ndarray | None = None,
+    block_rows: int = BLOCK_ROWS,
+) -> np.ndarray:
+    # ||q - e||^2 = ||q||^2 + ||e||^2 - 2 q.e, the cross term is one matmul
+    queries = np.asarray(queries, dtype=np.float32)
+    if x_sq_norms is None:
+        x_sq_norms = squared_norms(x, block_rows)
+
+    dist = np.empty((len(queries), len(x)), dtype=np.float32)
+    q_sq_norms = np.einsum("ij,ij->i", queries, queries)[:, None]
+    for start in range(0, len(x), block_rows):
+        block = np.asarray(x[start : start + block_rows], dtype=np.float32)
+        d = dist[:, start : start + block_rows]
+        np.matmul(queries, block.T, out=d)
+        d *= -2
+        d += q_sq_norms
+        d += x_sq_norms[start : start + block_rows]
+
+    # rounding can push the distance of (near) identical vectors below zero
+    np.maximum(dist, 0, out=dist)
+    return np.sqrt(dist, out=dist)
+
+
+def l1_distances(
+    queries: np.ndarray, x: np.ndarray, chunk_bytes: int = L1_CHUNK_BYTES
+) -> np.ndarray:
+    queries = np.asarray(queries, dtype=np.float32)
+    dist = np.empty((len(queries), len(x)), dtype=np.float32)
+    rows = max(1, chunk_bytes // (4 * max(1, queries.size)))
+    for start in range(0, len(x), rows):
+        block = np.asarray(x[start : start + rows], dtype=np.float32)
+        diff = np.abs(queries[:, None, :] - block[None, :, :])
+        dist[:, start : start + rows] = diff.sum(axis=2)
+    return dist
+
+
+class EmbeddingStore(object):
+    """
+    Read-only, memory-mapped TransE embeddings. The arrays are never copied
+    into private memory, so every process mapping the same files shares the
+    pages through the page cache.
+    """
+
+    def __init__(
+        self,
+        entity_emb_path: str = ENTITY_EMBEDS,
+        relation_emb_path: str = RELATION_EMBEDS,
+        dtype=np.float32,
+    ):
+        self.dtype = np.dtype(dtype)
+        self.entity_emb: np.ndarray = self.open_array(entity_emb_path, self.dtype)
+        self.relation_emb: np.ndarray = self.open_array(relation_emb_path, self.dtype)
+
+        # computed once, every l2 query only needs the q.e cross term
+        self.entity_sq_norms = squared_norms(self.entity_emb)
+
+    def distances(
+        self, queries: np.ndarray, rows: np.ndarray | None = None, metric: str = "l2"
+    ) -> np.ndarray:
+        # distances of every query to every entity, or to the given entity rows
+        entities = self.entity_emb if rows is None else self.entity_emb[rows]
+        if metric == "l2":
+            norms = self.entity_sq_norms if rows is None else self.entity_sq_norms[rows]
+            return l2_distances(queries, entities, norms)
+        if metric == "l1":
+            return l1_distances(queries, entities)
+        raise ValueError(f"Unknown metric '{metric}', expected one of {METRICS}")
+
+    @staticmethod
+    def cast_path(path: str, dtype: np.dtype) -> str:
+        root, ext = os.path.splitext(path)
+        return f"{root}.{dtype.name}{ext}"
+
+    @classmethod
+    def open_array(cls, path: str, dtype: np.dtype) -> np.ndarray:
+        arr = np.load(path, mmap_mode="r")
+        if arr.dtype == dtype:
+            return arr
+
+        # keep a down-cast copy next to the original so it can be mapped too
+        cast_path = cls.cast_path(path, dtype)
+        if not os.path.exists(cast_path) or os.path.getmtime(
+            cast_path
+        ) < os.path.getmtime(path):
+            # write to a temporary file first, workers starting at the same
+            # time must never map a half written copy
+            tmp_path = f"{cast_path}.{os.getpid()}.tmp"
+            out = np.lib.format.open_memmap(
+                tmp_path, mode="w+", dtype=dtype, shape=arr.shape
+            )
+            out[:] = arr
+            out.flush()
+            del out
+            os.replace(tmp_path, cast_path)
+
+        return np.load(cast_path, mmap_mode="r")
+
+
+_stores: dict[str, EmbeddingStore] = {}
+_stores_lock = threading.Lock()
+
+
+def get_embedding_store(dtype=np.float32) -> EmbeddingStore:
+    # process-wide store, shared by every EmbeddingAnswerer of this process
+    key = np.dtype(dtype).name
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = EmbeddingStore(dtype=dtype)
+        return _stores[key]
@@ -1,8 +1,11 @@
 import numpy as np
-import rdflib, csv
-from sklearn.metrics import pairwise_distances
+import rdflib
 
 import os
+import ann_index
+import candidate_sets
+import entity_index
+import embedding_store
 
 
 class EmbeddingRelation(object):
@@ -28,7 +31,13 @@ class EmbeddingRelation(object):
 
 
 class EmbeddingAnswerer(object):
-    def __init__(self):
+    def __init__(
+        self,
+        nprobe: int | None = ann_index.DEFAULT_NPROBE,
+        dtype=np.float32,
+        metric: str = "l2",
+        graph=None,
+    ):
         # Get the absolute path to the current directory
         current_directory = os.path.dirname(os.path.abspath(__file__))
 
@@ -36,20 +45,26 @@ class EmbeddingAnswerer(object):
         data_folder = os.path.join(current_directory, "data")
 
         # Use absolute paths for loading files from the "data" folder
-        entity_emb_path = os.path.join(data_folder, "entity_embeds.npy")
-        relation_emb_path = os.path.join(data_folder, "relation_embeds.npy")
         ent_ids_path = os.path.join(data_folder, "entity_ids.del")
+        ent_index_path = os.path.join(data_folder, "entity_embeds.ivf.npz")
 
-        # load the embeddings
-        self.entity_emb = np.load(entity_emb_path)
-        self.relation_emb = np.load(relation_emb_path)
+        # memory-mapped embeddings, shared by all answerers of the process
+        self.store = embedding_store.get_embedding_store(dtype)
+        self.entity_emb = self.store.entity_emb
+        self.relation_emb = self.store.relation_emb
 
-        with open(ent_ids_path, "r") as ifile:
-            self.ent2id = {
-                rdflib.term.URIRef(ent): int(idx)
-                for idx, ent in csv.reader(ifile, delimiter="\t")
-            }
-            self.id2ent = {v: k for k, v in self.ent2id.items()}
+        # nearest neighbour index over the entities, exact scan if not built
+        self.index = ann_index.load_index(self.store, ent_index_path, nprobe, metric)
+
+        # compact URI <-> embedding row table
+        self.entities = entity_index.EntityIdIndex.open(ent_ids_path)
+
+        # entities that can answer a relation, rebuilt when the graph changes
+        self.candidates: candidate_sets.RelationCandidates | None = None
+        if graph is not None:
+            self.candidates = candidate_sets.RelationCandidates.open(
+                graph.store, self.entities.get
+            )
 
     @staticmethod
     def is_predicate_in_embedding(relation_label: str) -> EmbeddingRelation | None:
@@ -62,26 +77,66 @@ class EmbeddingAnswerer(object):
     def calculate_embedding_node(
         self, subject, relation_key: int
     ) -> rdflib.IdentifiedNode | None:
-        ent_id = self.ent2id.get(subject)
+        candidates = self.calculate_embedding_candidates(subject, relation_key, 1)
+        return candidates[0][0]
+
+    def calculate_embedding_candidates(
+        self, subject, relation_key: int, k: int = 10
+    ) -> list[tuple[rdflib.IdentifiedNode, float]]:
+        ent_id = self.entities.get(subject)
         pred = self.relation_emb[relation_key]
         head = self.entity_emb[ent_id]
 
         lhs = head + pred
-        # compute distance to *any* entity
-        dist = pairwise_distances(lhs.reshape(1, -1), self.entity_emb).reshape(-1)
-        # find most plausible entities
-        most_likely = dist.argsort()
-        en = self.id2ent[most_likely[0]]
+        # find the k most plausible entities, closest first
+        rows = self.relation_candidates(relation_key)
+        most_likely, dist = self.index.search(lhs, k, rows)
+        return [(self.entities[i], float(d)) for i, d in zip(most_likely, dist)]
+
+    def calculate_embedding_nodes(
+        self, subjects: list, relation_keys: list[int]
+    ) -> list[rdflib.IdentifiedNode | None]:
+        # answer several (subject, relation) pairs with one batched scan
+        ent_ids = [self.entities.get(s) for s in subjects]
+        known = [i for i, e in enumerate(ent_ids) if e is not None]
+
+        answers = [None] * len(subjects)
+        if not known:
+            return answers
+
+        # questions about the same relation share their candidate set
+        by_relation: dict[int, list[int]] = {}
+        for i in known:
+            by_relation.setdefault(relation_keys[i], []).append(i)
 
-        return en
+        for relation_key, positions in by_relation.items():
+            lhs = (
+                self.entity_emb[[ent_ids[i] for i in positions]]
+                + self.relation_emb[relation_key]
+            )
+            rows = self.relation_candidates(relation_key)
+            most_likely, _ = self.index.search_many(lhs, 1, rows)
+            for i, row in zip(positions, most_likely):
+                answers[i] = self.entities[row[0]]
+        return answers
+
+    def relation_candidates(self, relation_key: int) -> np.ndarray | None:
+        if self.candidates is None:
+            return None
+        return self.candidates.get(relation_key)
 
     def get_n_closest(
         self, nodes: list[rdflib.IdentifiedNode], n=10
     ) -> list[rdflib.IdentifiedNode]:
+        return [node for node, _ in self.get_n_closest_scored(nodes, n)]
+
+    def get_n_closest_scored(
+        self, nodes: list[rdflib.IdentifiedNode], n=10
+    ) -> list[tuple[rdflib.IdentifiedNode, float]]:
         if not nodes or not any(nodes):
             return []
 
-        entities = [self.ent2id.get(n, None) for n in nodes]
+        entities = [self.entities.get(n, None) for n in nodes]
         if None in entities:
             return []
 
@@ -90,12 +145,36 @@ class EmbeddingAnswerer(object):
         )
 
         # Retrieve the closest entities
-        dist = pairwise_distances(center.reshape(1, -1), self.entity_emb).reshape(-1)
-        most_likely_indices = np.argsort(dist)
+        most_likely_indices, dist = self.index.search(center, n)
 
-        closest_entities = [self.id2ent[i] for i in most_likely_indices[:n]]
+        closest_entities = [
+            (self.entities[i], float(d)) for i, d in zip(most_likely_indices, dist)
+        ]
         return closest_entities
 
+    def get_n_closest_many(
+        self, node_groups: list[list[rdflib.IdentifiedNode]], n=10
+    ) -> list[list[rdflib.IdentifiedNode]]:
+        # one center per group of nodes, all centers are searched together
+        centers, positions = [], []
+        for i, nodes in enumerate(node_groups):
+            if not nodes or not any(nodes):
+                continue
+            entities = [self.entities.get(node, None) for node in nodes]
+            if None in entities:
+                continue
+            centers.append(np.mean(self.entity_emb[entities], axis=0))
+            positions.append(i)
+
+        closest = [[] for _ in node_groups]
+        if not centers:
+            return closest
+
+        most_likely_indices, _ = self.index.search_many(np.stack(centers), n)
+        for i, row in zip(positions, most_likely_indices):
+            closest[i] = [self.entities[e] for e in row]
+        return closest
+
 
 LABELS_IN_RELATION_IDS_DEL = {
     "cast member": 0,
@@ -1,15 +1,18 @@
 import os
 import re
 import utils
+from embedding_cache import EmbeddingCache
+from lexical_index import LexicalIndex
 import torch
-from sentence_transformers import SentenceTransformer, util
+from sentence_transformers import SentenceTransformer
 import numpy
 import pandas as pd
 import rdflib
 from nltk.util import everygrams
 from nltk.stem import PorterStemmer
 from nltk.tokenize import word_tokenize
-from typing import Optional
+from nltk.corpus import stopwords
+from typing import List, Optional
 
 
 # Get the absolute path to the current directory
@@ -21,7 +24,14 @@ data_folder = os.path.join(current_directory, "data")
 # Use absolute paths for loading files from the "data" folder
 PREDICATE_DESC = os.path.join(data_folder, "predicates_extended.csv")
 PRED_EMBEDDINGS = os.path.join(data_folder, "embeddings2.npy")
+PRED_EMBEDDINGS_NORMALISED = os.path.join(data_folder, "embeddings2.normalised.npy")
 REPLACE_PREDICATES_FILE = os.path.join(data_folder, "replace_predicates_ner.csv")
+NGRAM_EMBEDDINGS = os.path.join(data_folder, "ngram_embeddings.npz")
+
+SENTENCE_MODEL = "sentence-transformers/all-MiniLM-L6-v2"
+
+# minimal cosine similarity of an n-gram to a predicate label
+PREDICATE_THRESHOLD = 0.75
 
 
 class PossiblePredicate:
@@ -40,16 +50,87 @@ class EmbeddingRecognizer:
         pred_df_path: str = PREDICATE_DESC,
         pred_embeddings_path: str = PRED_EMBEDDINGS,
         replace_predicates_path: str = REPLACE_PREDICATES_FILE,
+        normalised_embeddings_path: str | None = PRED_EMBEDDINGS_NORMALISED,
+        ngram_cache_path: str | None = NGRAM_EMBEDDINGS,
     ):
-        self.model = SentenceTransformer("sentence-transformers/all-MiniLM-L6-v2")
+        self.model = SentenceTransformer(SENTENCE_MODEL)
+        # n-grams repeat across messages, only unseen ones are encoded
+        self.ngram_cache = EmbeddingCache(SENTENCE_MODEL, path=ngram_cache_path)
         self.stammer = PorterStemmer()
 
-        np_arr = numpy.load(pred_embeddings_path)
+        np_arr = self.load_normalised(pred_embeddings_path, normalised_embeddings_path)
         self.pred_embeddings = torch.from_numpy(np_arr).to("cpu")
         self.pred_df = pd.read_csv(pred_df_path)
 
         self.replace_predicates_df = pd.read_csv(replace_predicates_path)
 
+        # n-grams without any word of a predicate label are never encoded
+        self.stop_words = self.load_stop_words()
+        self.label_vocabulary = self.build_label_vocabulary(self.pred_df["label"])
+
+        # labels written literally in a question resolve without the model
+        self.lexical_index = self.build_lexical_index(self.pred_df["label"])
+
+    @staticmethod
+    def load_normalised(path: str, normalised_path: str | None = None) -> numpy.ndarray:
+        # unit length rows, so a cosine similarity is a plain dot product
+        if (
+            normalised_path is not None
+            and os.path.exists(normalised_path)
+            and os.path.getmtime(normalised_path) >= os.path.getmtime(path)
+        ):
+            return numpy.load(normalised_path)
+
+        arr = numpy.load(path).astype(numpy.float32)
+        norms = numpy.linalg.norm(arr, axis=1, keepdims=True)
+        arr /= numpy.maximum(norms, 1e-12)
+
+        if normalised_path is not None:
+            tmp_path = f"{normalised_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp_path, "wb") as f:
+                    numpy.save(f, arr)
+                os.replace(tmp_path, normalised_path)
+            except OSError:
+                pass
+        return arr
+
+    @staticmethod
+    def load_stop_words() -> frozenset:
+        try:
+            return frozenset(stopwords.words("english"))
+        except LookupError:
+            # corpus not downloaded, stop word spans are kept
+            return frozenset()
+
+    def build_label_vocabulary(self, labels) -> frozenset:
+        # lower-cased words of all predicate labels and their stems
+        vocabulary = set()
+        for label in labels:
+            for word in word_tokenize(str(label).lower()):
+                vocabulary.add(word)
+                vocabulary.add(self.stammer.stem(word))
+        return frozenset(vocabulary)
+
+    def build_lexical_index(self, labels) -> LexicalIndex:
+        # the words of every label and their stems, valued with the label row
+        patterns = []
+        for index, label in enumerate(labels):
+            words = word_tokenize(str(label).lower())
+            patterns.append((words, index))
+            patterns.append(([self.stammer.stem(w) for w in words], index))
+        return LexicalIndex(patterns)
+
+    def encode(self, words: list) -> torch.Tensor:
+        # normalised embeddings of words, served from the n-gram cache
+        embeddings = self.ngram_cache.encode(
+            words,
+            lambda misses: self.model.encode(
+                misses, convert_to_numpy=True, normalize_embeddings=True
+            ),
+        )
+        return torch.from_numpy(embeddings)
+
     @staticmethod
     def __max_len_everygrams(arr: list) -> int:
         return min(5, len(arr))
@@ -59,10 +140,13 @@ class EmbeddingRecognizer:
         query: str,
         org_label: str,
         org_string_found: str,
-        embedding_found: torch.Tensor,
+        embedding_found: torch.Tensor | None = None,
     ) -> str:
         if org_label in query:
             return query
+        if embedding_found is None:
+            # the span of the label in the query is known already
+            return self.__substitute_label(query, org_label, org_string_found)
 
         # Tokenize and generate everygrams from the original string
         words = [
@@ -73,15 +157,16 @@ class EmbeddingRecognizer:
             )
         ]
 
-        # Encode everygram embeddings
-        found_str_embedding = self.model.encode(
-            words, convert_to_tensor=True, device="cpu"
-        )
-        hits = util.semantic_search(embedding_found, found_str_embedding, top_k=1)
-        h = hits[0][0]
+        # Encode everygram embeddings, the predicate embedding is normalised
+        found_str_embedding = self.encode(words)
+        best = int((found_str_embedding @ embedding_found).argmax())
+
+        return self.__substitute_label(query, org_label, words[best])
 
+    @staticmethod
+    def __substitute_label(query: str, org_label: str, found: str) -> str:
         # Replace the found pattern in the query with org_label
-        pattern = re.escape(words[h["corpus_id"]])
+        pattern = re.escape(found)
         query = re.sub(
             rf"{pattern}(.*?)[\s,.?!-]", org_label + " ", query, flags=re.DOTALL
         )
@@ -94,59 +179,141 @@ class EmbeddingRecognizer:
             query = query.replace(org_string, r_df["fixed"].values[0])
         return query
 
-    def __generate_everygrams(self, query: str, stemming: bool) -> list:
-        split = word_tokenize(query)
-        words = [
-            " ".join(tup)
-            for tup in everygrams(split, max_len=self.__max_len_everygrams(split))
+    @staticmethod
+    def __entity_positions(split: list, entities: List[str]) -> set:
+        # token positions covered by an occurrence of a named entity
+        tokens = [w.lower() for w in split]
+        positions = set()
+        for entity in entities:
+            entity_tokens = word_tokenize(utils.remove_sent_endings(entity).lower())
+            n = len(entity_tokens)
+            if n == 0:
+                continue
+            for i in range(len(tokens) - n + 1):
+                if tokens[i : i + n] == entity_tokens:
+                    positions.update(range(i, i + n))
+        return positions
+
+    def __keep_span(
+        self, span: tuple, split: list, stemmed: list, entity_positions: set
+    ) -> bool:
+        if entity_positions.intersection(span):
+            return False
+        words = [split[i].lower() for i in span]
+        if all(w in self.stop_words for w in words):
+            return False
+        return any(
+            w in self.label_vocabulary or stemmed[i] in self.label_vocabulary
+            for i, w in zip(span, words)
+        )
+
+    def __generate_everygrams(
+        self, split: list, stemmed_words: list, stemming: bool, entity_positions: set
+    ) -> list:
+        # spans are generated as token positions and pruned before encoding:
+        # stop words only, overlapping an entity, or no predicate label word
+        spans = [
+            span
+            for span in everygrams(
+                list(range(len(split))), max_len=self.__max_len_everygrams(split)
+            )
+            if self.__keep_span(span, split, stemmed_words, entity_positions)
         ]
 
+        words = [" ".join(split[i] for i in span) for span in spans]
         if stemming:
-            stemmed_words = [self.stammer.stem(w) for w in split]
-            words.extend(
-                [
-                    " ".join(tup)
-                    for tup in everygrams(
-                        stemmed_words, max_len=self.__max_len_everygrams(stemmed_words)
-                    )
-                ]
-            )
+            words.extend(" ".join(stemmed_words[i] for i in span) for span in spans)
 
         words.sort(key=len, reverse=True)
         return words
 
+    def __lexical_hit(
+        self, split: list, stemmed_words: list, entity_positions: set
+    ) -> tuple[int, int, int] | None:
+        # (label row, start, end) of the longest literal label occurrence,
+        # None when there is none or the longest ones disagree on the predicate
+        tokens = [w.lower() for w in split]
+        matches = [
+            (start, end, index)
+            for words in (tokens, stemmed_words)
+            for start, end, index in self.lexical_index.find_all(words)
+            if not entity_positions.intersection(range(start, end))
+        ]
+        if not matches:
+            return None
+
+        longest = max(end - start for start, end, _ in matches)
+        matches = [m for m in matches if m[1] - m[0] == longest]
+        predicates = {self.pred_df["predicate"][index] for _, _, index in matches}
+        if len(predicates) != 1:
+            return None
+        start, end, index = min(matches)
+        return index, start, end
+
+    def __possible_predicate(
+        self,
+        original_query: str,
+        index: int,
+        found: str,
+        score: float,
+        embedding_found: torch.Tensor | None = None,
+    ) -> PossiblePredicate:
+        org_label = self.pred_df["org_label"][index]
+        string_found = self.pred_df["label"][index]
+
+        original_query = self.__fix_query(
+            original_query, org_label, found, embedding_found
+        )
+        original_query = self.__replace_pred(original_query, org_label, string_found)
+
+        return PossiblePredicate(
+            org_label,
+            score,
+            rdflib.term.URIRef(self.pred_df["predicate"][index]),
+            original_query,
+        )
+
     def get_predicates(
-        self, query: str, stemming: bool = True
+        self, query: str, stemming: bool = True, entities: List[str] | None = None
     ) -> Optional[PossiblePredicate]:
         original_query = query
         query = utils.remove_sent_endings(query)
 
-        words = self.__generate_everygrams(query, stemming)
-        query_embeddings = self.model.encode(
-            words, convert_to_tensor=True, device="cpu"
+        split = word_tokenize(query)
+        stemmed_words = [self.stammer.stem(w) for w in split]
+        entity_positions = self.__entity_positions(split, entities or [])
+
+        # an unambiguous literal label skips the model
+        hit = self.__lexical_hit(
+            split, stemmed_words if stemming else [], entity_positions
         )
+        if hit is not None:
+            index, start, end = hit
+            return self.__possible_predicate(
+                original_query, index, " ".join(split[start:end]), 1.0
+            )
+
+        words = self.__generate_everygrams(
+            split, stemmed_words, stemming, entity_positions
+        )
+        if not words:
+            return None
+        query_embeddings = self.encode(words)
 
-        for i, query_embed in enumerate(query_embeddings):
-            hits = util.semantic_search(query_embed, self.pred_embeddings, top_k=1)
-            hits = hits[0]
-
-            if hits[0]["score"] >= 0.75:
-                index = hits[0]["corpus_id"]
-                org_label = self.pred_df["org_label"][index]
-                string_found = self.pred_df["label"][index]
-
-                original_query = self.__fix_query(
-                    original_query, org_label, words[i], self.pred_embeddings[index]
-                )
-                original_query = self.__replace_pred(
-                    original_query, org_label, string_found
-                )
-
-                return PossiblePredicate(
-                    org_label,
-                    hits[0]["score"],
-                    rdflib.term.URIRef(self.pred_df["predicate"][index]),
-                    original_query,
-                )
-
-        return None
+        # all n-grams against all predicate labels in one product, the
+        # n-grams are sorted longest first so the first hit wins
+        scores = query_embeddings @ self.pred_embeddings.T
+        best_scores, best_index = scores.max(dim=1)
+        hits = torch.nonzero(best_scores >= PREDICATE_THRESHOLD)
+        if len(hits) == 0:
+            return None
+
+        i = int(hits[0])
+        index = int(best_index[i])
+        return self.__possible_predicate(
+            original_query,
+            index,
+            words[i],
+            float(best_scores[i]),
+            self.pred_embeddings[index],
+        )
@@ -1,9 +1,9 @@
-import os
 import rdflib
 import utils
 import re
 import random
-from entity_recognizer import EntityRecognizer
+from typing import List
+from entity_recognizer import EntityRecognizer, NamedEntity
 import embeddings_recognition as embeddings_rec
 import embeddings
 from Graph import Graph
@@ -27,56 +27,114 @@ class EntryClassifier:
     def __init__(self):
         # Initialize components
         self.entity_recognizer = EntityRecognizer()
-        self.embedding_answerer = embeddings.EmbeddingAnswerer()
-        self.graph = Graph(
-            os.path.join(
-                os.path.dirname(os.path.abspath(__file__)),
-                "data",
-                "pickle_graph.pickel",
-            )
+        self.graph = Graph(Graph.default_path())
+        self.embedding_answerer = embeddings.EmbeddingAnswerer(graph=self.graph)
+        self.recomender = recomender.MovieRecommender(
+            self.graph, self.embedding_answerer
         )
-        self.recomender = recomender.MovieRecommender(self.graph)
         self.embedding_recognizer = embeddings_rec.EmbeddingRecognizer()
 
     def start(self, query: str) -> str:
-        # Preprocess query
-        cleaned_query = utils.remove_different_minus_scores(query)
-
-        # Get predicates using embedding recognizer
-        predicate = self.embedding_recognizer.get_predicates(cleaned_query)
-
-        if not predicate:
-            # Ansewer the question using reccomentation
+        response = self.start_many([query])[0]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def start_many(self, queries: List[str]) -> List[str | Exception]:
+        # Answer all queries of a poll cycle, the embedding lookups of all
+        # factual questions are answered by one batched scan.
+        # Failed queries get their exception in place of the response.
+        responses: List[str | Exception | None] = [None] * len(queries)
+        pending_embedding = []
+
+        for i, query in enumerate(queries):
+            try:
+                # Preprocess query
+                cleaned_query = utils.remove_different_minus_scores(query)
+
+                # Entities first, their spans are never predicate candidates;
+                # the graph path reuses them, one NER pass per question
+                named_entities = self.entity_recognizer.get_named_entities(
+                    cleaned_query, is_question=True
+                )
+                entities = [x.original_text for x in named_entities]
+
+                # Get predicates using embedding recognizer
+                predicate = self.embedding_recognizer.get_predicates(
+                    cleaned_query, entities=entities
+                )
+
+                if not predicate:
+                    # Ansewer the question using reccomentation
+                    responses[i] = self.answer_recommendation(cleaned_query, entities)
+                    continue
+
+                # Check if predicate exists in embeddings
+                is_predicate_in_embeddings = (
+                    self.embedding_answerer.is_predicate_in_embedding(predicate.label)
+                )
+
+                if is_predicate_in_embeddings:
+                    # Answer the question using embeddings, batched below
+                    entity = self.get_embedding_subject(predicate.fixed_query)
+                    pending_embedding.append((i, entity, is_predicate_in_embeddings))
+                else:
+                    # Answer the question using KG
+                    responses[i] = self.answer_graph_question(
+                        query, predicate, named_entities
+                    )
+            except Exception as e:
+                responses[i] = e
+
+        if pending_embedding:
+            try:
+                answer_entities = self.embedding_answerer.calculate_embedding_nodes(
+                    [entity for _, entity, _ in pending_embedding],
+                    [relation.relation_key for _, _, relation in pending_embedding],
+                )
+            except Exception as e:
+                answer_entities = [e] * len(pending_embedding)
+
+            for (i, _, _), answer_entity in zip(pending_embedding, answer_entities):
+                try:
+                    if isinstance(answer_entity, Exception):
+                        raise answer_entity
+                    answer = self.embedding_node_to_answer(answer_entity)
+                    template = random.choice(self.FACTUAL_RESPONSE_TEMPLATES)
+                    responses[i] = template.format(answer)
+                except Exception as e:
+                    responses[i] = e
+
+        return responses
+
+    def answer_recommendation(
+        self, cleaned_query: str, entities: List[str] | None = None
+    ) -> str:
+        if entities is None:
             entities = self.entity_recognizer.get_entities(cleaned_query)
-            answer = self.recomender.recommend_embedding(entities)
-            template = random.choice(self.RECOMMENDATION_RESPONSE_TEMPLATES)
-            formatted_response = template.format(answer)
-            return formatted_response
-
-        # Check if predicate exists in embeddings
-        is_predicate_in_embeddings = self.embedding_answerer.is_predicate_in_embedding(
-            predicate.label
-        )
+        answer = self.recomender.recommend_embedding(entities)
+        template = random.choice(self.RECOMMENDATION_RESPONSE_TEMPLATES)
+        formatted_response = template.format(answer)
+        return formatted_response
 
-        if is_predicate_in_embeddings:
-            # Answer the question using embeddings
-            answer = self.answer_embedding_question(
-                predicate.fixed_query, is_predicate_in_embeddings
-            )
-            template = random.choice(self.FACTUAL_RESPONSE_TEMPLATES)
-            formatted_response = template.format(answer)
-            return formatted_response
-        else:
+    def answer_graph_question(
+        self, query: str, predicate, named_entities: List[NamedEntity] | None = None
+    ) -> str:
+        if named_entities is None:
             prediction = self.entity_recognizer.get_single_entity(
                 query, is_question=True
             )
+        else:
+            # the entities were predicted on the cleaned query, which has the
+            # same length, the title is taken from the query as written
+            sentence = utils.add_sentence_ending(query, is_question=True)
+            prediction = self.entity_recognizer.merge_entities(sentence, named_entities)
 
-            entity: rdflib.IdentifiedNode | None = None
+        entity: rdflib.IdentifiedNode | None = None
 
-            res = self.graph.get_movie_with_label(prediction.original_text)
-            entity = res[0]
-            # Answer the question using KG
-            answer = str(self.graph.get_answer(predicate.predicate, entity)[0])
+        res = self.graph.get_movie_with_label(prediction.original_text)
+        entity = res[0]
+        answer = str(self.graph.get_answer(predicate.predicate, entity)[0])
         template = random.choice(self.FACTUAL_RESPONSE_TEMPLATES)
         formatted_response = template.format(answer)
         return formatted_response
@@ -84,6 +142,15 @@ class EntryClassifier:
     def answer_embedding_question(
         self, query: str, relation: embeddings.EmbeddingRelation
     ) -> str:
+        entity = self.get_embedding_subject(query)
+
+        answer_entity = self.embedding_answerer.calculate_embedding_node(
+            entity, relation.relation_key
+        )
+
+        return self.embedding_node_to_answer(answer_entity)
+
+    def get_embedding_subject(self, query: str) -> rdflib.IdentifiedNode:
         # handle when questions
 
         prediction = self.entity_recognizer.get_single_entity(query, is_question=True)
@@ -91,11 +158,9 @@ class EntryClassifier:
 
         res = self.graph.get_movie_with_label(prediction.original_text)
         entity = res[0]
+        return entity
 
-        answer_entity = self.embedding_answerer.calculate_embedding_node(
-            entity, relation.relation_key
-        )
-
+    def embedding_node_to_answer(self, answer_entity: rdflib.IdentifiedNode) -> str:
         answer_label = self.graph.entity_to_label(answer_entity)
         return " {}".format(answer_label.toPython())
 
@@ -7,8 +7,6 @@ from Graph import Graph
 
 current_directory = os.path.dirname(os.path.abspath(__file__))
 
-GRAPH_PICKLE = os.path.join(current_directory, "data/pickle_graph.pickel")
-
 # Load relation IDs from file
 with open(os.path.join(current_directory, "data/relation_ids.del"), "r") as ifile:
     rel2id = {
@@ -18,7 +16,7 @@ with open(os.path.join(current_directory, "data/relation_ids.del"), "r") as ifil
     id2rel = {v: k for k, v in rel2id.items()}
 
 # Create a Graph object
-graph = Graph(GRAPH_PICKLE)
+graph = Graph(Graph.default_path())
 
 # Create a dictionary mapping entities to labels
 ent2lbl = {
@@ -0,0 +1,123 @@
+import os
+import csv
+import re
+import numpy as np
+import rdflib
+
+# Get the absolute path to the current directory
+current_directory = os.path.dirname(os.path.abspath(__file__))
+
+# Define the relative path to the "data" folder
+data_folder = os.path.join(current_directory, "data")
+
+ENTITY_IDS = os.path.join(data_folder, "entity_ids.del")
+ENTITY_ID_INDEX = os.path.join(data_folder, "entity_ids.npz")
+
+WD_PREFIX = "http://www.wikidata.org/entity/"
+_WD_ENTITY = re.compile(rf"{re.escape(WD_PREFIX)}Q(\d+)")
+
+
+class EntityIdIndex(object):
+    """
+    Maps entity URIs to embedding rows and back. Wikidata entities are kept
+    as sorted arrays of Q-numbers, only the few other URIs need a dict.
+    """
+
+    def __init__(
+        self,
+        q_numbers: np.ndarray,
+        q_rows: np.ndarray,
+        row_q: np.ndarray,
+        other_uris: np.ndarray,
+        other_rows: np.ndarray,
+    ):
+        # q_numbers is sorted, q_rows[i] is the row of entity Q{q_numbers[i]}
+        self.q_numbers = q_numbers
+        self.q_rows = q_rows
+        # Q-number of every row, -1 for rows that are not wikidata entities
+        self.row_q = row_q
+        self.other = {str(u): int(r) for u, r in zip(other_uris, other_rows)}
+        self.other_by_row = {r: u for u, r in self.other.items()}
+
+    def __len__(self) -> int:
+        return len(self.row_q)
+
+    def get(self, entity, default=None) -> int | None:
+        if entity is None:
+            return default
+        entity = str(entity)
+        match = _WD_ENTITY.fullmatch(entity)
+        if not match:
+            return self.other.get(entity, default)
+
+        q = int(match.group(1))
+        pos = np.searchsorted(self.q_numbers, q)
+        if pos < len(self.q_numbers) and self.q_numbers[pos] == q:
+            return int(self.q_rows[pos])
+        return default
+
+    def __getitem__(self, row: int) -> rdflib.term.URIRef:
+        q = self.row_q[row]
+        if q < 0:
+            return rdflib.term.URIRef(self.other_by_row[int(row)])
+        return rdflib.term.URIRef(f"{WD_PREFIX}Q{q}")
+
+    @classmethod
+    def from_del(cls, path: str = ENTITY_IDS):
+        rows, qs, other_uris, other_rows = [], [], [], []
+        with open(path, "r") as ifile:
+            for idx, ent in csv.reader(ifile, delimiter="\t"):
+                match = _WD_ENTITY.fullmatch(ent)
+                if match:
+                    rows.append(int(idx))
+                    qs.append(int(match.group(1)))
+                else:
+                    other_uris.append(ent)
+                    other_rows.append(int(idx))
+
+        rows = np.array(rows, dtype=np.int32)
+        qs = np.array(qs, dtype=np.int32)
+        order = np.argsort(qs, kind="stable")
+
+        row_q = np.full(len(rows) + len(other_rows), -1, dtype=np.int32)
+        row_q[rows] = qs
+        return cls(
+            qs[order],
+            rows[order],
+            row_q,
+            np.array(other_uris, dtype=str),
+            np.array(other_rows, dtype=np.int32),
+        )
+
+    def save(self, path: str = ENTITY_ID_INDEX):
+        other_uris = list(self.other.keys())
+        np.savez(
+            path,
+            q_numbers=self.q_numbers,
+            q_rows=self.q_rows,
+            row_q=self.row_q,
+            other_uris=np.array(other_uris, dtype=str),
+            other_rows=np.array([self.other[u] for u in other_uris], dtype=np.int32),
+        )
+
+    @classmethod
+    def load(cls, path: str = ENTITY_ID_INDEX):
+        with np.load(path) as data:
+            return cls(
+                data["q_numbers"],
+                data["q_rows"],
+                data["row_q"],
+                data["other_uris"],
+                data["other_rows"],
+            )
+
+    @classmethod
+    def open(cls, del_path: str = ENTITY_IDS, path: str = ENTITY_ID_INDEX):
+        # parse entity_ids.del only once, later starts read the binary table
+        if os.path.exists(path) and os.path.getmtime(path) >= os.path.getmtime(
+            del_path
+        ):
+            return cls.load(path)
+        index = cls.from_del(del_path)
+        index.save(path)
+        return index
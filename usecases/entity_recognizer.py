@@ -39,29 +39,38 @@ class EntityRecognizer:
             )
         return entities
 
-    def get_single_entity(self, sentence, is_question=False):
+    def get_named_entities(self, sentence, is_question=False):
         sentence = utils.add_sentence_ending(sentence, is_question=is_question)
         predictions = self.ner_pipeline(sentence)
-        entities = self.extract_entities(sentence, predictions)
+        return self.extract_entities(sentence, predictions)
 
+    @staticmethod
+    def merge_entities(sentence, entities):
+        # the entities as one span of sentence, which may be another text of
+        # the same length than the one the entities were predicted on
+        entities = sorted(entities, key=lambda x: x.start)
         if len(entities) == 1:
-            return entities[0]
-
-        entities.sort(key=lambda x: x.start)
-        start_entity = entities[0]
-        end_entity = max(entities, key=lambda x: x.end)
-        merged_text = sentence[start_entity.start : end_entity.end]
+            start_entity = end_entity = entities[0]
+            word = start_entity.word
+            entity_type = start_entity.entity_type
+        else:
+            start_entity = entities[0]
+            end_entity = max(entities, key=lambda x: x.end)
+            word = f"{start_entity.word} -> {end_entity.word}"
+            entity_type = "MISC"
 
         return NamedEntity(
-            "MISC",
-            f"{start_entity.word} -> {end_entity.word}",
+            entity_type,
+            word,
             start_entity.start,
             end_entity.end,
-            merged_text,
+            sentence[start_entity.start : end_entity.end],
         )
 
-    def get_entities(self, sentence, is_question=False):
+    def get_single_entity(self, sentence, is_question=False):
         sentence = utils.add_sentence_ending(sentence, is_question=is_question)
-        predictions = self.ner_pipeline(sentence)
-        entities = self.extract_entities(sentence, predictions)
+        return self.merge_entities(sentence, self.get_named_entities(sentence))
+
+    def get_entities(self, sentence, is_question=False):
+        entities = self.get_named_entities(sentence, is_question=is_question)
         return [x.original_text for x in entities]
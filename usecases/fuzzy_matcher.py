@@ -0,0 +1,177 @@
+import re
+from array import array
+from typing import Iterable
+import numpy as np
+
+try:
+    from editdistance import eval as edit_distance
+except ImportError:
+    edit_distance = None
+
+
+_NON_ALNUM = re.compile(r"[^\w]+")
+
+# candidates kept from the trigram stage for the edit distance re-rank
+DEFAULT_CANDIDATES = 10
+# minimal similarity (1 - normalised edit distance) of an accepted match
+DEFAULT_CUTOFF = 0.8
+
+
+def normalise(text: str) -> str:
+    # case, punctuation and repeated spaces never decide a title match
+    return " ".join(_NON_ALNUM.sub(" ", text.lower()).split())
+
+
+def trigrams(text: str) -> set[str]:
+    padded = f"  {text} "
+    return {padded[i : i + 3] for i in range(len(padded) - 2)}
+
+
+def levenshtein(a: str, b: str) -> int:
+    if len(a) < len(b):
+        a, b = b, a
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(
+                min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb))
+            )
+        previous = current
+    return previous[-1]
+
+
+if edit_distance is None:
+    edit_distance = levenshtein
+
+
+def similarity(a: str, b: str) -> float:
+    longest = max(len(a), len(b))
+    return 1.0 if longest == 0 else 1.0 - edit_distance(a, b) / longest
+
+
+class FuzzyMatcher(object):
+    """
+    Approximate label search. Candidates share the most character trigrams
+    with the query (inverted index, Dice coefficient) and are re-ranked by
+    edit distance. Entities and labels are kept as triple store term ids.
+    """
+
+    # arrays of a matcher, e.g. to cache it as side indexes of a store
+    ARRAYS = ("keys", "entities", "labels", "grams", "postings", "offsets", "counts")
+
+    def __init__(
+        self,
+        keys: list[str],
+        entities: np.ndarray,
+        labels: np.ndarray,
+        gram_ids: dict[str, int],
+        postings: np.ndarray,
+        offsets: np.ndarray,
+        gram_counts: np.ndarray,
+    ):
+        self.keys = keys
+        self.entities = entities
+        self.labels = labels
+        self.gram_ids = gram_ids
+        # postings of all trigrams stored contiguously, grouped by trigram
+        self.postings = postings
+        self.offsets = offsets
+        self.gram_counts = gram_counts
+
+    @classmethod
+    def build(cls, entries: Iterable[tuple[str, int, int]]):
+        # entries are (label text, entity id, label id)
+        keys, entities, labels = [], array("i"), array("i")
+        gram_ids: dict[str, int] = {}
+        gram_counts = array("i")
+        pairs_gram, pairs_entry = array("i"), array("i")
+        for text, entity, label in entries:
+            key = normalise(text)
+            pos = len(keys)
+            keys.append(key)
+            entities.append(entity)
+            labels.append(label)
+            grams = trigrams(key)
+            gram_counts.append(len(grams))
+            for gram in grams:
+                pairs_gram.append(gram_ids.setdefault(gram, len(gram_ids)))
+                pairs_entry.append(pos)
+
+        grams = np.frombuffer(pairs_gram, dtype=np.int32)
+        order = np.argsort(grams, kind="stable")
+        counts = np.bincount(grams, minlength=len(gram_ids))
+        return cls(
+            keys,
+            np.frombuffer(entities, dtype=np.int32),
+            np.frombuffer(labels, dtype=np.int32),
+            gram_ids,
+            np.frombuffer(pairs_entry, dtype=np.int32)[order],
+            np.concatenate(([0], np.cumsum(counts))),
+            np.frombuffer(gram_counts, dtype=np.int32),
+        )
+
+    def to_arrays(self) -> dict[str, np.ndarray]:
+        # normalised keys and trigrams never contain a line break
+        def blob(texts):
+            return np.frombuffer("\n".join(texts).encode("utf-8"), dtype=np.uint8)
+
+        return {
+            "keys": blob(self.keys),
+            "entities": self.entities,
+            "labels": self.labels,
+            "grams": blob(self.gram_ids),
+            "postings": self.postings,
+            "offsets": self.offsets,
+            "counts": self.gram_counts,
+        }
+
+    @classmethod
+    def from_arrays(cls, arrays: dict[str, np.ndarray]):
+        def texts(blob, n):
+            return bytes(blob).decode("utf-8").split("\n") if n else []
+
+        grams = texts(arrays["grams"], len(arrays["offsets"]) - 1)
+        return cls(
+            texts(arrays["keys"], len(arrays["entities"])),
+            arrays["entities"],
+            arrays["labels"],
+            {gram: i for i, gram in enumerate(grams)},
+            arrays["postings"],
+            arrays["offsets"],
+            arrays["counts"],
+        )
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def search(
+        self,
+        text: str,
+        limit: int = 1,
+        cutoff: float = DEFAULT_CUTOFF,
+        allowed: np.ndarray | None = None,
+        candidates: int = DEFAULT_CANDIDATES,
+    ) -> list[tuple[int, float]]:
+        # (entry, similarity) pairs, best first; allowed masks out entries
+        key = normalise(text)
+        query_grams = [self.gram_ids[g] for g in trigrams(key) if g in self.gram_ids]
+        if not key or not query_grams or not len(self.keys):
+            return []
+
+        hits = np.concatenate(
+            [self.postings[self.offsets[g] : self.offsets[g + 1]] for g in query_grams]
+        )
+        shared = np.bincount(hits, minlength=len(self.keys))
+        dice = 2.0 * shared / (len(trigrams(key)) + self.gram_counts)
+        if allowed is not None:
+            dice[~allowed] = 0
+
+        n = min(candidates, len(dice))
+        best = np.argpartition(-dice, n - 1)[:n]
+        best = best[dice[best] > 0]
+
+        scored = [(int(pos), similarity(key, self.keys[pos])) for pos in best]
+        scored = [(pos, score) for pos, score in scored if score >= cutoff]
+        scored.sort(key=lambda x: -x[1])
+        return scored[:limit]
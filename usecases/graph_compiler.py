@@ -0,0 +1,203 @@
+import io
+import os
+import json
+import heapq
+import argparse
+import shutil
+import tempfile
+import multiprocessing
+from array import array
+import numpy as np
+import rdflib
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+from triple_store import (
+    NAMESPACES_FILE,
+    SIDE_INDEX_DIR,
+    TERM_OFFSETS_FILE,
+    TERMS_FILE,
+    TripleStore,
+    build_indexes,
+    install_store,
+    write_build,
+)
+from Graph import COMMON_CLASSES, GRAPH_STORE, class_members, label_table
+
+# bytes of the N-Triples file parsed by one task
+DEFAULT_CHUNK_BYTES = 64 << 20
+
+
+class _LabelledBNodes(dict):
+    # blank nodes keep their label, so _:b1 is the same node in every chunk
+    def get(self, key, default=None):
+        return key
+
+
+class _InterningSink(object):
+    """Receives parsed triples, interns their terms as canonical N3."""
+
+    def __init__(self):
+        self.term_ids: dict[str, int] = {}
+        self.triples = array("i")
+
+    def triple(self, s, p, o):
+        for term in (s, p, o):
+            key = term.n3()
+            term_id = self.term_ids.get(key)
+            if term_id is None:
+                term_id = self.term_ids[key] = len(self.term_ids)
+            self.triples.append(term_id)
+
+
+def chunk_ranges(path: str, chunk_bytes: int = DEFAULT_CHUNK_BYTES) -> list:
+    # byte ranges of about chunk_bytes that end after a line break
+    size = os.path.getsize(path)
+    ranges = []
+    with open(path, "rb") as f:
+        start = 0
+        while start < size:
+            f.seek(min(start + chunk_bytes, size))
+            f.readline()
+            end = min(f.tell(), size)
+            ranges.append((start, end))
+            start = end
+    return ranges
+
+
+def parse_chunk(task: tuple) -> tuple[str, str, int]:
+    # parses one byte range and writes its sorted terms and its triples as
+    # chunk local term ids, returns the file prefix, the triples file and the
+    # number of terms
+    source, start, end, prefix = task
+    with open(source, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    sink = _InterningSink()
+    W3CNTriplesParser(sink, bnode_context=_LabelledBNodes()).parse(io.BytesIO(data))
+    del data
+
+    keys = [key.encode("utf-8") for key in sink.term_ids]
+    order = sorted(range(len(keys)), key=keys.__getitem__)
+    remap = np.empty(len(keys), dtype=np.int32)
+    remap[order] = np.arange(len(keys), dtype=np.int32)
+
+    # sorted terms as one blob with offsets, like the term table of a store
+    terms_file = f"{prefix}.terms"
+    with open(terms_file, "wb") as f:
+        for pos in order:
+            f.write(keys[pos])
+    offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+    offsets[1:] = np.cumsum([len(keys[pos]) for pos in order])
+    np.save(f"{prefix}.offsets.npy", offsets)
+
+    triples_file = f"{prefix}.triples.npy"
+    np.save(triples_file, remap[np.frombuffer(sink.triples, dtype=np.int32)])
+    return prefix, triples_file, len(keys)
+
+
+def merge_terms(chunks: list, output: str) -> list[np.ndarray]:
+    # k-way merge of the sorted chunk terms into the term table of the store,
+    # returns per chunk the global id of each of its local ids
+    remaps = [np.empty(n_terms, dtype=np.int32) for _, _, n_terms in chunks]
+    files = [open(f"{prefix}.terms", "rb") for prefix, _, _ in chunks]
+
+    def entries(chunk, f):
+        offsets = np.load(f"{chunks[chunk][0]}.offsets.npy")
+        for local_id, size in enumerate(np.diff(offsets).tolist()):
+            yield f.read(size), chunk, local_id
+
+    offsets = array("q", [0])
+    previous = None
+    try:
+        with open(os.path.join(output, TERMS_FILE), "wb") as terms:
+            for key, chunk, local_id in heapq.merge(
+                *(entries(chunk, f) for chunk, f in enumerate(files))
+            ):
+                if key != previous:
+                    terms.write(key)
+                    offsets.append(offsets[-1] + len(key))
+                    previous = key
+                remaps[chunk][local_id] = len(offsets) - 2
+    finally:
+        for f in files:
+            f.close()
+
+    np.save(os.path.join(output, TERM_OFFSETS_FILE), np.frombuffer(offsets, np.int64))
+    return remaps
+
+
+def compile_graph(
+    source: str,
+    output: str,
+    workers: int | None = None,
+    chunk_bytes: int = DEFAULT_CHUNK_BYTES,
+) -> TripleStore:
+    # the store is built in a sibling directory and moved into place, a
+    # failed build leaves the previous store untouched
+    output = os.path.abspath(output)
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    build_dir = tempfile.mkdtemp(
+        dir=os.path.dirname(output), prefix=f".{os.path.basename(output)}."
+    )
+    try:
+        os.chmod(build_dir, 0o755)
+        write_store(source, build_dir, workers, chunk_bytes)
+        install_store(build_dir, output)
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+    return TripleStore.open(output)
+
+
+def write_store(source: str, output: str, workers: int | None, chunk_bytes: int):
+    with tempfile.TemporaryDirectory(dir=output) as tmp:
+        tasks = [
+            (source, start, end, os.path.join(tmp, f"chunk{i}"))
+            for i, (start, end) in enumerate(chunk_ranges(source, chunk_bytes))
+        ]
+        workers = min(workers or os.cpu_count() or 1, max(len(tasks), 1))
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                chunks = pool.map(parse_chunk, tasks, chunksize=1)
+        else:
+            chunks = [parse_chunk(task) for task in tasks]
+
+        remaps = merge_terms(chunks, output)
+        spo = np.concatenate(
+            [np.empty(0, dtype=np.int32)]
+            + [remap[np.load(f)] for remap, (_, f, _) in zip(remaps, chunks)]
+        )
+        del remaps
+
+    for name, index in build_indexes(spo.reshape(-1, 3).T).items():
+        np.save(os.path.join(output, f"{name}.npy"), index)
+        n_triples = index.shape[1]
+    del spo
+
+    # N-Triples bind no prefixes, a parsed graph only has rdflib's defaults
+    namespaces = {prefix: str(ns) for prefix, ns in rdflib.Graph().namespaces()}
+    with open(os.path.join(output, NAMESPACES_FILE), "w") as f:
+        json.dump(namespaces, f)
+
+    n_terms = len(np.load(os.path.join(output, TERM_OFFSETS_FILE), mmap_mode="r")) - 1
+    write_build(output, n_terms, n_triples)
+
+    # side indexes are written next to the store by side_index
+    store = TripleStore.open(output)
+    label_table(store)
+    for name, cls in COMMON_CLASSES.items():
+        class_members(store, name, cls)
+    os.makedirs(os.path.join(output, SIDE_INDEX_DIR), exist_ok=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Compile an N-Triples file into the triple store of the bot."
+    )
+    parser.add_argument("source")
+    parser.add_argument("--output", default=GRAPH_STORE)
+    parser.add_argument("--workers", type=int, default=None)
+    parser.add_argument("--chunk-mb", type=int, default=DEFAULT_CHUNK_BYTES >> 20)
+    args = parser.parse_args()
+
+    store = compile_graph(args.source, args.output, args.workers, args.chunk_mb << 20)
+    print(f"Saved {len(store)} triples over {store.n_terms} terms to {args.output}")
@@ -0,0 +1,57 @@
+import bisect
+from typing import Iterable
+import numpy as np
+
+
+class LabelIndex(object):
+    """
+    Lower-cased labels of a set of entities. Exact lookups hit a dict, prefix
+    lookups binary search the sorted keys and substring lookups scan all keys
+    joined into one string, which str.find does at C speed.
+    Entities and labels are kept as triple store term ids.
+    """
+
+    def __init__(self, entries: Iterable[tuple[str, int, int]]):
+        # entries are (label text, entity id, label id)
+        entries = sorted((text.lower(), e, l) for text, e, l in entries)
+        self.keys = [key for key, _, _ in entries]
+        self.entities = np.array([e for _, e, _ in entries], dtype=np.int32)
+        self.labels = np.array([l for _, _, l in entries], dtype=np.int32)
+
+        self.exact: dict[str, int] = {}
+        for pos, key in enumerate(self.keys):
+            self.exact.setdefault(key, pos)
+
+        # keys never contain a newline, so a match never spans two keys
+        self.blob = "\n".join(self.keys)
+        self.starts = np.cumsum([0] + [len(key) + 1 for key in self.keys[:-1]])
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def find_exact(self, text: str) -> int | None:
+        return self.exact.get(text.lower())
+
+    def find_prefix(self, text: str) -> int | None:
+        text = text.lower()
+        pos = bisect.bisect_left(self.keys, text)
+        if pos < len(self.keys) and self.keys[pos].startswith(text):
+            return pos
+        return None
+
+    def find_substring(self, text: str) -> int | None:
+        text = text.lower()
+        if not text or "\n" in text:
+            return None
+        offset = self.blob.find(text)
+        if offset < 0:
+            return None
+        return int(np.searchsorted(self.starts, offset, "right")) - 1
+
+    def find(self, text: str) -> tuple[int, int] | None:
+        # best match first: the whole label, then its start, then anywhere
+        for lookup in (self.find_exact, self.find_prefix, self.find_substring):
+            pos = lookup(text)
+            if pos is not None:
+                return int(self.entities[pos]), int(self.labels[pos])
+        return None
@@ -0,0 +1,59 @@
+from collections import deque
+from typing import Iterable, List, Sequence
+
+
+class LexicalIndex(object):
+    """
+    Aho-Corasick automaton over word sequences. Finds every occurrence of
+    every pattern in one pass over the tokens of a text, each pattern
+    carrying a value, e.g. the row of a predicate label.
+    """
+
+    def __init__(self, patterns: Iterable[tuple[Sequence[str], object]]):
+        # state 0 is the root, goto[state] maps a word to the next state
+        self.goto: List[dict[str, int]] = [{}]
+        self.fail: List[int] = [0]
+        # (pattern length, value) of the patterns ending in a state
+        self.outputs: List[list[tuple[int, object]]] = [[]]
+
+        for words, value in patterns:
+            if not words:
+                continue
+            state = 0
+            for word in words:
+                next_state = self.goto[state].get(word)
+                if next_state is None:
+                    next_state = len(self.goto)
+                    self.goto[state][word] = next_state
+                    self.goto.append({})
+                    self.fail.append(0)
+                    self.outputs.append([])
+                state = next_state
+            self.outputs[state].append((len(words), value))
+
+        # breadth first, so the fail state of a parent is known first
+        queue = deque(self.goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for word, child in self.goto[state].items():
+                queue.append(child)
+                fallback = self.fail[state]
+                while fallback and word not in self.goto[fallback]:
+                    fallback = self.fail[fallback]
+                self.fail[child] = self.goto[fallback].get(word, 0)
+                self.outputs[child].extend(self.outputs[self.fail[child]])
+
+    def __len__(self) -> int:
+        return len(self.goto)
+
+    def find_all(self, words: Sequence[str]) -> List[tuple[int, int, object]]:
+        # (start, end, value) of every match, end is exclusive
+        matches = []
+        state = 0
+        for end, word in enumerate(words, 1):
+            while state and word not in self.goto[state]:
+                state = self.fail[state]
+            state = self.goto[state].get(word, 0)
+            for length, value in self.outputs[state]:
+                matches.append((end - length, end, value))
+        return matches
@@ -0,0 +1,57 @@
+import time
+import threading
+from collections import OrderedDict
+
+# number of distinct queries kept
+DEFAULT_MAX_SIZE = 256
+# seconds after which a cached result is evaluated again
+DEFAULT_TTL = 600.0
+
+
+class QueryCache(object):
+    """Bounded LRU cache of query results with a time-to-live per entry."""
+
+    def __init__(self, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries: OrderedDict[str, tuple[float, object]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def normalise(query: str) -> str:
+        # indentation and blank lines do not change the meaning of a query,
+        # spaces inside a line are kept as they may be part of a literal
+        lines = (line.strip() for line in query.splitlines())
+        return "\n".join(line for line in lines if line)
+
+    def get(self, key: str) -> tuple[bool, object]:
+        now = time.monotonic()
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None and now - entry[0] <= self.ttl:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self.entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key: str, value: object):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = (time.monotonic(), value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"size": len(self.entries), "hits": self.hits, "misses": self.misses}
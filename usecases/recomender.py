@@ -9,9 +9,13 @@ from Graph import Graph
 
 
 class MovieRecommender(object):
-    def __init__(self, graph: Graph):
+    def __init__(
+        self,
+        graph: Graph,
+        embedding_answerer: embeddings.EmbeddingAnswerer | None = None,
+    ):
         self.graph = graph
-        self.embeddings = embeddings.EmbeddingAnswerer()
+        self.embeddings = embedding_answerer or embeddings.EmbeddingAnswerer()
 
     def recommend_embedding(self, movie_names: List[str]) -> str:
         movie_names = [i for i in movie_names if i != "The" or i != "the" or len(i) < 3]
@@ -30,7 +34,9 @@ class MovieRecommender(object):
         closest_set.difference_update(movie_nodes)
 
         # transform to movie label list
-        lbl_2_ent = {self.graph.entity_to_label(x): x for x in closest_set}
+        closest_list = list(closest_set)
+        labels = self.graph.entities_to_labels(closest_list)
+        lbl_2_ent = {lbl: x for lbl, x in zip(labels, closest_list)}
 
         # filter out movies with the same label (e.g., remove newer versions of the same movie)
         movies = [x for x in lbl_2_ent.keys() if x not in movie_names]
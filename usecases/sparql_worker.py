@@ -0,0 +1,139 @@
+import os
+import queue
+import threading
+import multiprocessing
+
+# wall-clock seconds a user query may run before its worker is killed
+DEFAULT_TIMEOUT = 10.0
+# rows evaluated and returned for one user query
+DEFAULT_MAX_ROWS = 1000
+
+
+def _serve(graph, conn):
+    # runs in the forked child, the graph pages are shared copy-on-write
+    while True:
+        try:
+            query, max_rows = conn.recv()
+        except EOFError:
+            return
+        # the result cache is left to the parent, its lock may have been
+        # held by another thread at fork time
+        try:
+            result = graph.evaluate_sparql(graph.clean_query(query), max_rows)
+        except Exception as e:
+            result = f"Error: {str(e)}"
+        conn.send(result)
+
+
+class SparqlWorker(object):
+    """
+    Evaluates SPARQL queries in a forked child process. A query running
+    longer than its timeout gets the child killed, the next query starts a
+    fresh one, so one pathological query never blocks the bot.
+    """
+
+    def __init__(
+        self,
+        graph,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_rows: int | None = DEFAULT_MAX_ROWS,
+    ):
+        self.graph = graph
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.ctx = multiprocessing.get_context("fork")
+        self.process = None
+        self.conn = None
+        self.lock = threading.Lock()
+
+    @staticmethod
+    def is_supported() -> bool:
+        return "fork" in multiprocessing.get_all_start_methods()
+
+    def start(self):
+        parent_conn, child_conn = self.ctx.Pipe()
+        self.process = self.ctx.Process(
+            target=_serve, args=(self.graph, child_conn), daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.conn = parent_conn
+
+    def stop(self):
+        if self.process is None:
+            return
+        self.process.terminate()
+        self.process.join(1)
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+        self.process = None
+        self.conn = None
+
+    def query(
+        self, query: str, timeout: float | None = None, max_rows: int | None = None
+    ):
+        timeout = self.timeout if timeout is None else timeout
+        max_rows = self.max_rows if max_rows is None else max_rows
+        with self.lock:
+            if self.process is None or not self.process.is_alive():
+                self.stop()
+                self.start()
+
+            self.conn.send((query, max_rows))
+            if not self.conn.poll(timeout):
+                self.stop()
+                return f"Error: query timed out after {timeout:g} seconds"
+            try:
+                return self.conn.recv()
+            except EOFError:
+                self.stop()
+                return "Error: query worker exited"
+
+
+class SparqlWorkerPool(object):
+    """
+    A fixed number of SparqlWorker processes sharing one graph. Each query
+    takes a free worker from a queue, so up to `workers` queries are
+    evaluated in parallel on separate cores.
+    """
+
+    def __init__(
+        self,
+        graph,
+        workers: int | None = None,
+        timeout: float = DEFAULT_TIMEOUT,
+        max_rows: int | None = DEFAULT_MAX_ROWS,
+    ):
+        workers = workers or os.cpu_count() or 1
+        self.timeout = timeout
+        self.max_rows = max_rows
+        self.workers = [SparqlWorker(graph, timeout, max_rows) for _ in range(workers)]
+        self.free: queue.Queue[SparqlWorker] = queue.Queue()
+        for worker in self.workers:
+            self.free.put(worker)
+
+    def __len__(self) -> int:
+        return len(self.workers)
+
+    def start(self):
+        # fork all workers now instead of on their first query
+        for worker in self.workers:
+            with worker.lock:
+                if worker.process is None:
+                    worker.start()
+
+    def stop(self):
+        for worker in self.workers:
+            with worker.lock:
+                worker.stop()
+
+    def query(
+        self, query: str, timeout: float | None = None, max_rows: int | None = None
+    ):
+        worker = self.free.get()
+        try:
+            return worker.query(query, timeout, max_rows)
+        finally:
+            self.free.put(worker)
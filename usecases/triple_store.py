@@ -0,0 +1,679 @@
+import os
+import json
+import uuid
+import shutil
+import bisect
+import pickle
+import argparse
+from array import array
+from functools import lru_cache
+from typing import Callable, Iterable, Iterator
+import numpy as np
+import rdflib
+from rdflib.paths import Path
+from rdflib.plugins.sparql import CUSTOM_EVALS
+from rdflib.plugins.sparql.sparql import FrozenBindings
+from rdflib.store import Store
+from rdflib.util import from_n3
+
+TERMS_FILE = "terms.bin"
+TERM_OFFSETS_FILE = "term_offsets.npy"
+NAMESPACES_FILE = "namespaces.json"
+BUILD_FILE = "build.json"
+# arrays derived from the triples, named after the build they belong to
+SIDE_INDEX_DIR = "side"
+
+# every index stores the triples as three sorted rows, in this column order
+PERMUTATIONS = {
+    "spo": (0, 1, 2),
+    "pos": (1, 2, 0),
+    "osp": (2, 0, 1),
+}
+
+# files of a saved store besides the build file and the side indexes
+STORE_FILES = [TERMS_FILE, TERM_OFFSETS_FILE, NAMESPACES_FILE] + [
+    f"{name}.npy" for name in PERMUTATIONS
+]
+
+# decoded terms kept per store, most lookups hit a small set of entities
+TERM_CACHE_SIZE = 1 << 18
+# rows converted to python ints at once while iterating a range
+ITER_BLOCK = 4096
+# ranges up to this many rows are narrowed down in python, cheaper than numpy
+SMALL_RANGE = 64
+# a join looks up every distinct key of its solutions in an index when they
+# are this many times fewer than the matches of the pattern, otherwise it
+# scans the matches once
+LOOKUP_JOIN_RATIO = 64
+
+
+def decode_n3(key: str) -> rdflib.term.Node:
+    # URIs and literals without escapes are built directly, from_n3 is only
+    # needed to unescape the rest
+    if "\\" not in key:
+        if key.startswith("<"):
+            return rdflib.term.URIRef(key[1:-1])
+        if key.startswith('"') and not key.startswith('"""'):
+            end = key.rindex('"')
+            value, rest = key[1:end], key[end + 1 :]
+            if not rest:
+                return rdflib.term.Literal(value)
+            if rest.startswith("@"):
+                return rdflib.term.Literal(value, lang=rest[1:])
+            if rest.startswith("^^<"):
+                return rdflib.term.Literal(
+                    value, datatype=rdflib.term.URIRef(rest[3:-1])
+                )
+    return from_n3(key)
+
+
+def pattern_variables(pattern: tuple) -> dict:
+    # positions of every variable of a pattern
+    variables = {}
+    for position, term in enumerate(pattern):
+        if not isinstance(term, int):
+            variables.setdefault(term, []).append(position)
+    return variables
+
+
+def bound_ids(pattern: tuple, values: dict | None = None) -> list[int | None]:
+    # the ids of a pattern, variables with a value in values bound to it
+    values = values or {}
+    return [t if isinstance(t, int) else values.get(t) for t in pattern]
+
+
+def agreeing(variables: dict, rows: np.ndarray) -> np.ndarray | None:
+    # rows in which a variable used twice, e.g. ?x p ?x, has one value
+    keep = None
+    for first, *others in variables.values():
+        for position in others:
+            same = rows[first] == rows[position]
+            keep = same if keep is None else keep & same
+    return keep
+
+
+def bind_pattern(pattern: tuple, rows: np.ndarray) -> tuple[int, dict]:
+    # the solutions of one pattern from its matching (3, n) rows
+    variables = pattern_variables(pattern)
+    keep = agreeing(variables, rows)
+    if keep is not None:
+        rows = rows[:, keep]
+    return rows.shape[1], {var: rows[first] for var, (first, *_) in variables.items()}
+
+
+def key_groups(keys: np.ndarray, values: np.ndarray) -> np.ndarray:
+    # column of keys (sorted, unique) equal to each column of values, -1 for
+    # none
+    if len(keys) == 1:
+        pos = np.minimum(np.searchsorted(keys[0], values[0]), keys.shape[1] - 1)
+        return np.where(keys[0][pos] == values[0], pos, -1)
+    _, inverse = np.unique(
+        np.concatenate([keys, values], axis=1), axis=1, return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    group = np.full(inverse.max() + 1, -1)
+    group[inverse[: keys.shape[1]]] = np.arange(keys.shape[1])
+    return group[inverse[keys.shape[1] :]]
+
+
+class TermTable(object):
+    """
+    Dictionary of all terms as sorted N3 strings, stored as one UTF-8 blob
+    with offsets. The id of a term is its position in the sorted table.
+    """
+
+    def __init__(self, blob, offsets: np.ndarray):
+        self.blob = blob
+        # plain views, slicing a memmap object costs more than the lookup
+        self.data = memoryview(blob)
+        self.offsets = offsets.view(np.ndarray)
+
+    def __len__(self) -> int:
+        return len(self.offsets) - 1
+
+    def __getitem__(self, term_id: int) -> bytes:
+        return bytes(self.data[self.offsets[term_id] : self.offsets[term_id + 1]])
+
+    def find(self, key: bytes) -> int | None:
+        term_id = bisect.bisect_left(self, key)
+        if term_id < len(self) and self[term_id] == key:
+            return term_id
+        return None
+
+
+class TermBitmap(object):
+    """One bit per term id, e.g. the members of a class."""
+
+    def __init__(self, bits: np.ndarray, size: int):
+        self.bits = bits
+        self.size = size
+
+    @classmethod
+    def from_ids(cls, ids: np.ndarray, size: int):
+        mask = np.zeros(size, dtype=bool)
+        mask[ids] = True
+        return cls(np.packbits(mask), size)
+
+    def __contains__(self, term_id: int) -> bool:
+        return bool((self.bits[term_id >> 3] >> (7 - (term_id & 7))) & 1)
+
+    def __len__(self) -> int:
+        return int(np.unpackbits(self.bits, count=self.size).sum())
+
+    def mask(self, term_ids: np.ndarray) -> np.ndarray:
+        # vectorised membership test for an array of ids
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        return ((self.bits[term_ids >> 3] >> (7 - (term_ids & 7))) & 1).astype(bool)
+
+    def ids(self) -> np.ndarray:
+        return np.flatnonzero(np.unpackbits(self.bits, count=self.size))
+
+
+class TripleStore(object):
+    """
+    Read-only dictionary encoded triple store. The triples are kept in three
+    sorted integer indexes (SPO, POS, OSP) so every triple pattern is a
+    binary search followed by a contiguous range scan.
+    """
+
+    def __init__(
+        self,
+        terms: TermTable,
+        indexes: dict[str, np.ndarray],
+        namespaces: dict[str, str] | None = None,
+        path: str | None = None,
+        build: str | None = None,
+    ):
+        self.terms = terms
+        self.indexes = {name: index.view(np.ndarray) for name, index in indexes.items()}
+        # directory of a compiled store, None for a store built in memory
+        self.path = path
+        # id of the saved store, side indexes of another build are ignored
+        self.build = build
+        # prefixes bound in the source graph, usable in SPARQL without PREFIX
+        self.namespaces = namespaces or {}
+        self.term = lru_cache(maxsize=TERM_CACHE_SIZE)(self.decode_term)
+        # SPARQL joins look up the same bound terms for every solution
+        self.term_id = lru_cache(maxsize=TERM_CACHE_SIZE)(self.find_term_id)
+        # ids of the terms decoded last, a join binds the terms one pattern
+        # yielded into the next pattern, they need no search of the table
+        self.decoded_ids: dict[rdflib.term.Node, int] = {}
+
+    def __len__(self) -> int:
+        return self.indexes["spo"].shape[1]
+
+    @property
+    def n_terms(self) -> int:
+        return len(self.terms)
+
+    def find_term_id(self, term: rdflib.term.Node) -> int | None:
+        term_id = self.decoded_ids.get(term)
+        if term_id is not None:
+            return term_id
+        return self.terms.find(term.n3().encode("utf-8"))
+
+    def decode_term(self, term_id: int) -> rdflib.term.Node:
+        term = decode_n3(self.terms[term_id].decode("utf-8"))
+        if len(self.decoded_ids) >= TERM_CACHE_SIZE:
+            self.decoded_ids.clear()
+        self.decoded_ids[term] = term_id
+        return term
+
+    def index_range(self, name: str, keys: list[int]) -> tuple[int, int]:
+        # narrow down the rows matching the bound leading columns of an index
+        index = self.indexes[name]
+        lo, hi = 0, index.shape[1]
+        for col, key in enumerate(keys):
+            if hi - lo <= SMALL_RANGE:
+                column = index[col, lo:hi].tolist()
+                lo, hi = (
+                    lo + bisect.bisect_left(column, key),
+                    lo + bisect.bisect_right(column, key),
+                )
+            else:
+                # a key of the column dtype, a python int makes numpy cast
+                # the whole column first
+                column, key = index[col, lo:hi], index.dtype.type(key)
+                lo, hi = (
+                    lo + int(column.searchsorted(key, "left")),
+                    lo + int(column.searchsorted(key, "right")),
+                )
+            if lo == hi:
+                break
+        return lo, hi
+
+    def choose_index(
+        self, s: int | None, p: int | None, o: int | None
+    ) -> tuple[str, list[int]]:
+        if s is not None:
+            if p is None and o is not None:
+                return "osp", [o, s]
+            keys = [s]
+            if p is not None:
+                keys.append(p)
+                if o is not None:
+                    keys.append(o)
+            return "spo", keys
+        if p is not None:
+            return "pos", [p] if o is None else [p, o]
+        if o is not None:
+            return "osp", [o]
+        return "spo", []
+
+    def match(
+        self, s: int | None = None, p: int | None = None, o: int | None = None
+    ) -> np.ndarray:
+        # all matching triples as a (3, n) array of ids in s, p, o order
+        name, keys = self.choose_index(s, p, o)
+        lo, hi = self.index_range(name, keys)
+        rows = self.indexes[name][:, lo:hi]
+        order = PERMUTATIONS[name]
+        return rows[[order.index(c) for c in range(3)]]
+
+    def triple_ids(
+        self, s: int | None = None, p: int | None = None, o: int | None = None
+    ) -> Iterator[tuple[int, int, int]]:
+        name, keys = self.choose_index(s, p, o)
+        lo, hi = self.index_range(name, keys)
+        index = self.indexes[name]
+        order = PERMUTATIONS[name]
+        columns = [order.index(c) for c in range(3)]
+        for start in range(lo, hi, ITER_BLOCK):
+            block = index[:, start : min(start + ITER_BLOCK, hi)]
+            yield from zip(*(block[c].tolist() for c in columns))
+
+    def pattern_size(self, pattern: tuple) -> int:
+        # matches of a pattern with its variables left unbound
+        lo, hi = self.index_range(*self.choose_index(*bound_ids(pattern)))
+        return hi - lo
+
+    def bgp_solutions(self, patterns: list[tuple]) -> Iterator[tuple[int, dict]]:
+        # solutions of a basic graph pattern in blocks of (rows, term ids per
+        # variable); a pattern holds the id of a bound term or a variable, any
+        # object that is not an int, at each position
+        if not patterns:
+            yield 1, {}
+            return
+        first = 0
+        if len(patterns) > 1:
+            first = min(
+                range(len(patterns)), key=lambda i: self.pattern_size(patterns[i])
+            )
+        pattern, rest = patterns[first], patterns[:first] + patterns[first + 1 :]
+        name, keys = self.choose_index(*bound_ids(pattern))
+        lo, hi = self.index_range(name, keys)
+        order = PERMUTATIONS[name]
+        columns = [order.index(c) for c in range(3)]
+        for start in range(lo, hi, ITER_BLOCK):
+            rows = self.indexes[name][:, start : min(start + ITER_BLOCK, hi)]
+            yield from self.join_patterns(*bind_pattern(pattern, rows[columns]), rest)
+
+    def join_patterns(
+        self, n: int, table: dict, patterns: list[tuple]
+    ) -> Iterator[tuple[int, dict]]:
+        if not n:
+            return
+        if not patterns:
+            yield n, table
+            return
+        # the smallest pattern sharing a variable with the solutions goes
+        # next, a cross product is only built when nothing is shared
+        joinable = [
+            i
+            for i, pattern in enumerate(patterns)
+            if any(var in table for var in pattern_variables(pattern))
+        ] or range(len(patterns))
+        next_ = min(joinable, key=lambda i: self.pattern_size(patterns[i]))
+        pattern, rest = patterns[next_], patterns[:next_] + patterns[next_ + 1 :]
+        for start in range(0, n, ITER_BLOCK):
+            block = {var: col[start : start + ITER_BLOCK] for var, col in table.items()}
+            for joined in self.join_pattern(min(n - start, ITER_BLOCK), block, pattern):
+                yield from self.join_patterns(*joined, rest)
+
+    def join_pattern(
+        self, n: int, table: dict, pattern: tuple
+    ) -> Iterator[tuple[int, dict]]:
+        variables = pattern_variables(pattern)
+        shared = [var for var in variables if var in table]
+        if not shared:
+            # every solution pairs with every match, streamed per solution
+            for i in range(n):
+                row = {var: col[i : i + 1] for var, col in table.items()}
+                for m, matches in self.bgp_solutions([pattern]):
+                    yield m, {
+                        **{var: col.repeat(m) for var, col in row.items()},
+                        **matches,
+                    }
+            return
+
+        keys, key_of_row = np.unique(
+            np.stack([table[var] for var in shared]), axis=1, return_inverse=True
+        )
+        key_of_row = key_of_row.reshape(-1)
+        if keys.shape[1] * LOOKUP_JOIN_RATIO < self.pattern_size(pattern):
+            # few keys, each is looked up with the shared variables bound
+            parts, groups = [], []
+            for group, key in enumerate(keys.T.tolist()):
+                values = dict(zip(shared, key))
+                rows = self.match(*bound_ids(pattern, values))
+                parts.append(rows)
+                groups.append(np.full(rows.shape[1], group))
+            rows = np.concatenate(parts, axis=1)
+            key_of_match = np.concatenate(groups)
+        else:
+            # many keys, the matches of the bound terms are scanned once
+            rows = self.match(*bound_ids(pattern))
+            positions = [variables[var][0] for var in shared]
+            key_of_match = key_groups(keys, rows[positions])
+
+        keep = key_of_match >= 0
+        agree = agreeing(variables, rows)
+        if agree is not None:
+            keep &= agree
+        rows, key_of_match = rows[:, keep], key_of_match[keep]
+
+        # every solution with every match of its key
+        order = np.argsort(key_of_match, kind="stable")
+        sorted_keys = key_of_match[order]
+        lo = np.searchsorted(sorted_keys, key_of_row, "left")
+        counts = np.searchsorted(sorted_keys, key_of_row, "right") - lo
+        starts = np.cumsum(counts) - counts
+        left = np.repeat(np.arange(n), counts)
+        right = order[np.repeat(lo - starts, counts) + np.arange(counts.sum())]
+        joined = {var: col[left] for var, col in table.items()}
+        for var, (position, *_) in variables.items():
+            if var not in table:
+                joined[var] = rows[position][right]
+        yield len(left), joined
+
+    def subjects_closure(self, p: int, o: int) -> np.ndarray:
+        # all x with a path x p* o, e.g. the transitive subclasses of a class
+        seen = {o}
+        frontier = [o]
+        while frontier:
+            found = np.concatenate([self.match(p=p, o=node)[0] for node in frontier])
+            frontier = [x for x in set(found.tolist()) if x not in seen]
+            seen.update(frontier)
+        return np.array(sorted(seen), dtype=np.int32)
+
+    def instances_of(self, cls: int, instance_of: int, subclass_of: int) -> TermBitmap:
+        # members of x instance_of/subclass_of* cls, materialised once
+        classes = self.subjects_closure(subclass_of, cls)
+        s, _, o = self.match(p=instance_of)
+        members = s[np.isin(o, classes)]
+        return TermBitmap.from_ids(members, self.n_terms)
+
+    def first_objects(self, p: int) -> np.ndarray:
+        # per term id the first object of p in SPO order (-1 for none), e.g.
+        # the label of every entity as an array lookup
+        s, _, o = self.match(p=p)
+        order = np.lexsort((o, s))
+        subjects, first = np.unique(s[order], return_index=True)
+        objects = np.full(self.n_terms, -1, dtype=np.int32)
+        objects[subjects] = o[order][first]
+        return objects
+
+    @classmethod
+    def from_triples(cls, triples: Iterable[tuple]):
+        # intern the terms, ids are reassigned in sorted order afterwards
+        term_ids: dict[bytes, int] = {}
+        encoded = array("l")
+        for triple in triples:
+            for term in triple:
+                key = term.n3().encode("utf-8")
+                term_id = term_ids.get(key)
+                if term_id is None:
+                    term_id = term_ids[key] = len(term_ids)
+                encoded.append(term_id)
+
+        keys = sorted(term_ids)
+        remap = np.empty(len(keys), dtype=np.int32)
+        for new_id, key in enumerate(keys):
+            remap[term_ids[key]] = new_id
+        del term_ids
+
+        flat = np.frombuffer(encoded, dtype=f"i{encoded.itemsize}")
+        spo = remap[flat].reshape(-1, 3).T
+        offsets = np.zeros(len(keys) + 1, dtype=np.int64)
+        offsets[1:] = np.cumsum([len(k) for k in keys])
+        terms = TermTable(b"".join(keys), offsets)
+        return cls(terms, build_indexes(spo))
+
+    @classmethod
+    def from_graph(cls, graph: rdflib.Graph):
+        store = cls.from_triples(graph.triples((None, None, None)))
+        store.namespaces = {prefix: str(ns) for prefix, ns in graph.namespaces()}
+        return store
+
+    def save(self, path: str):
+        os.makedirs(path, exist_ok=True)
+        with open(os.path.join(path, TERMS_FILE), "wb") as f:
+            f.write(bytes(self.terms.blob))
+        np.save(os.path.join(path, TERM_OFFSETS_FILE), self.terms.offsets)
+        for name, index in self.indexes.items():
+            np.save(os.path.join(path, f"{name}.npy"), index)
+        with open(os.path.join(path, NAMESPACES_FILE), "w") as f:
+            json.dump(self.namespaces, f)
+        self.build = write_build(path, self.n_terms, len(self))
+
+    @classmethod
+    def open(cls, path: str):
+        # everything is memory-mapped, nothing is parsed at start up
+        terms_path = os.path.join(path, TERMS_FILE)
+        blob = b""
+        if os.path.getsize(terms_path):
+            blob = np.memmap(terms_path, dtype=np.uint8, mode="r")
+        offsets = np.load(os.path.join(path, TERM_OFFSETS_FILE), mmap_mode="r")
+        indexes = {
+            name: np.load(os.path.join(path, f"{name}.npy"), mmap_mode="r")
+            for name in PERMUTATIONS
+        }
+        with open(os.path.join(path, NAMESPACES_FILE), "r") as f:
+            namespaces = json.load(f)
+        store = cls(TermTable(blob, offsets), indexes, namespaces, path)
+        store.build = read_build(path, store.n_terms, len(store))
+        return store
+
+    def side_index(self, name: str, build: Callable[[], np.ndarray]) -> np.ndarray:
+        # arrays derived from the triples are cached next to the indexes of a
+        # compiled store and memory-mapped by later starts
+        if self.path is None or self.build is None:
+            return build()
+        file = os.path.join(self.path, SIDE_INDEX_DIR, f"{name}.{self.build}.npy")
+        if os.path.exists(file):
+            return np.load(file, mmap_mode="r")
+        arr = build()
+        tmp_file = f"{file}.{os.getpid()}.tmp"
+        try:
+            os.makedirs(os.path.dirname(file), exist_ok=True)
+            with open(tmp_file, "wb") as f:
+                np.save(f, arr)
+            os.replace(tmp_file, file)
+        except OSError:
+            pass
+        return arr
+
+
+def write_build(path: str, n_terms: int, n_triples: int) -> str:
+    # a new build id for the files in path, the side indexes of earlier
+    # builds are dropped
+    shutil.rmtree(os.path.join(path, SIDE_INDEX_DIR), ignore_errors=True)
+    build = uuid.uuid4().hex
+    with open(os.path.join(path, BUILD_FILE), "w") as f:
+        json.dump({"build": build, "n_terms": n_terms, "n_triples": n_triples}, f)
+    return build
+
+
+def read_build(path: str, n_terms: int, n_triples: int) -> str | None:
+    # None when the build file is missing or does not describe these indexes,
+    # side indexes are then computed but never cached
+    try:
+        with open(os.path.join(path, BUILD_FILE), "r") as f:
+            stamp = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if stamp.get("n_terms") != n_terms or stamp.get("n_triples") != n_triples:
+        return None
+    return stamp.get("build")
+
+
+def build_indexes(spo: np.ndarray) -> dict[str, np.ndarray]:
+    # spo is a (3, n) array of term ids, duplicates are dropped
+    spo = np.unique(spo, axis=1)
+    indexes = {}
+    for name, order in PERMUTATIONS.items():
+        rows = spo[list(order)]
+        # lexsort sorts by the last key first
+        sort = np.lexsort(rows[::-1])
+        indexes[name] = np.ascontiguousarray(rows[:, sort], dtype=np.int32)
+    return indexes
+
+
+def install_store(build_dir: str, output: str):
+    if not os.path.exists(output):
+        os.replace(build_dir, output)
+        return
+
+    # the output may hold other files, e.g. usecases/data, so only the files
+    # of a store are replaced; the build file goes first and comes back last,
+    # the side indexes of a half installed store are never trusted
+    build_file = os.path.join(output, BUILD_FILE)
+    if os.path.exists(build_file):
+        os.remove(build_file)
+    for name in STORE_FILES:
+        os.replace(os.path.join(build_dir, name), os.path.join(output, name))
+    shutil.rmtree(os.path.join(output, SIDE_INDEX_DIR), ignore_errors=True)
+    os.replace(
+        os.path.join(build_dir, SIDE_INDEX_DIR), os.path.join(output, SIDE_INDEX_DIR)
+    )
+    os.replace(os.path.join(build_dir, BUILD_FILE), build_file)
+
+
+class TripleStoreAdapter(Store):
+    """Exposes a TripleStore as a read-only rdflib store, e.g. for SPARQL."""
+
+    context_aware = False
+    formula_aware = False
+    transaction_aware = False
+    graph_aware = False
+
+    def __init__(self, triple_store: TripleStore):
+        super().__init__()
+        self.triple_store = triple_store
+        self.__namespace: dict[str, rdflib.URIRef] = {}
+        self.__prefix: dict[rdflib.URIRef, str] = {}
+        for prefix, namespace in triple_store.namespaces.items():
+            self.bind(prefix, rdflib.URIRef(namespace))
+
+    def triples(self, triple_pattern, context=None):
+        ids = []
+        for term in triple_pattern:
+            if term is None:
+                ids.append(None)
+                continue
+            term_id = self.triple_store.term_id(term)
+            if term_id is None:
+                # a term that is not in the dictionary matches nothing
+                return
+            ids.append(term_id)
+
+        term = self.triple_store.term
+        for s, p, o in self.triple_store.triple_ids(*ids):
+            yield (term(s), term(p), term(o)), iter(())
+
+    def solutions(self, ctx, triples: list) -> Iterator[FrozenBindings]:
+        # a basic graph pattern joined on term ids, only the solutions are
+        # decoded; the bindings of ctx are bound terms of the patterns
+        patterns = []
+        for triple in triples:
+            pattern = []
+            for term in triple:
+                value = ctx[term]
+                if value is None:
+                    pattern.append(term)
+                    continue
+                term_id = self.triple_store.term_id(value)
+                if term_id is None:
+                    return
+                pattern.append(term_id)
+            patterns.append(tuple(pattern))
+
+        base = dict(ctx.bindings.items())
+        term = self.triple_store.term
+        for n, table in self.triple_store.bgp_solutions(patterns):
+            variables = list(table)
+            rows = zip(*(table[var].tolist() for var in variables))
+            for row in rows if variables else [()] * n:
+                bindings = dict(base)
+                bindings.update(zip(variables, map(term, row)))
+                yield FrozenBindings(ctx, bindings)
+
+    def __len__(self, context=None) -> int:
+        return len(self.triple_store)
+
+    def contexts(self, triple=None):
+        return iter(())
+
+    def add(self, triple, context, quoted=False):
+        raise TypeError("The triple store is read-only")
+
+    def remove(self, triple, context=None):
+        raise TypeError("The triple store is read-only")
+
+    def bind(self, prefix, namespace, override=True):
+        bound_namespace = self.__namespace.get(prefix)
+        bound_prefix = self.__prefix.get(namespace)
+        if override:
+            if bound_prefix is not None:
+                del self.__namespace[bound_prefix]
+            if bound_namespace is not None:
+                del self.__prefix[bound_namespace]
+            self.__prefix[namespace] = prefix
+            self.__namespace[prefix] = namespace
+        else:
+            self.__prefix[bound_namespace or namespace] = bound_prefix or prefix
+            self.__namespace[bound_prefix or prefix] = bound_namespace or namespace
+
+    def namespace(self, prefix):
+        return self.__namespace.get(prefix)
+
+    def prefix(self, namespace):
+        return self.__prefix.get(namespace)
+
+    def namespaces(self):
+        yield from self.__namespace.items()
+
+
+def evaluate_bgp(ctx, part):
+    # rdflib tries this for every part of a query, basic graph patterns over a
+    # TripleStore are joined on term ids, property paths and the other parts
+    # are left to rdflib
+    store = getattr(ctx.graph, "store", None)
+    if part.name != "BGP" or not isinstance(store, TripleStoreAdapter):
+        raise NotImplementedError
+    if any(isinstance(term, Path) for triple in part.triples for term in triple):
+        raise NotImplementedError
+    return store.solutions(ctx, part.triples)
+
+
+CUSTOM_EVALS["triple_store"] = evaluate_bgp
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Convert a pickled rdflib graph or a .nt file to a triple store."
+    )
+    parser.add_argument("source")
+    parser.add_argument("output")
+    args = parser.parse_args()
+
+    if args.source.endswith(".nt"):
+        source = rdflib.Graph()
+        source.parse(args.source, format="nt")
+    else:
+        with open(args.source, "rb") as graph:
+            source = pickle.load(graph)
+
+    store = TripleStore.from_graph(source)
+    store.save(args.output)
+    print(f"Saved {len(store)} triples over {store.n_terms} terms to {args.output}")
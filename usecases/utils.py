@@ -29,11 +29,12 @@ def lower_remove_sent_endings_at_end(inp: str):
     )
 
 
+# prepared once by Graph, ?filmName is bound at call time
 GET_FILM_BY_NAME_FILTER = """
             SELECT DISTINCT ?film ?queryByTitle WHERE{
                 ?film wdt:P31/wdt:P279* wd:Q2431196.                                                                 
                 ?film rdfs:label ?queryByTitle.                                                          
-                FILTER(REGEX(?queryByTitle, "%(filmName)s", "i"))
+                FILTER(REGEX(?queryByTitle, ?filmName, "i"))
             }
             LIMIT 1
         """